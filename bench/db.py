@@ -0,0 +1,116 @@
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import aiosqlite
+from database.database import Database
+
+async def scratch_database():
+    """A connected Database on a throwaway file; returns (database, directory to remove)"""
+    directory = tempfile.mkdtemp()
+    database = Database()
+    database.db_path = os.path.join(directory, 'bench.db')
+    await database.connect()
+    return database, directory
+
+async def bench_xp(users=200, messages=5000):
+    """Chat XP committed once per message, as Level.on_message used to, against the buffered path"""
+    results = {}
+    for name, per_message in (('per-message', True), ('buffered', False)):
+        database, directory = await scratch_database()
+        try:
+            rng = random.Random(1)
+            for user_id in range(1, users + 1):
+                await database.get_user(user_id, f'user{user_id}', '0')
+            started = time.perf_counter()
+            for _ in range(messages):
+                await database.add_xp(rng.randint(1, users), rng.randint(15, 25))
+                if per_message:
+                    await database.flush_xp()
+            await database.flush_xp()
+            elapsed = time.perf_counter() - started
+            results[name] = await database.fetchall('SELECT user_id, total_xp, xp, level FROM users ORDER BY user_id')
+            print(f'{name:<12} {messages} messages in {elapsed:6.2f}s  {messages / elapsed:>10,.0f} msg/s')
+        finally:
+            await database.close()
+            shutil.rmtree(directory)
+    return results['per-message'] == results['buffered']
+
+async def bench_pool(users=100000, clients=4, rounds=10):
+    """Full-table scans racing balance updates, on one rollback-journal connection and on the WAL pool"""
+    scan = 'SELECT * FROM users ORDER BY balance + bank DESC LIMIT 10'
+    database, directory = await scratch_database()
+    await database.write(lambda conn: conn.executemany(
+        'INSERT INTO users (user_id, username, discriminator, balance, bank) VALUES (?, ?, ?, ?, ?)',
+        ((user_id, f'user{user_id}', '0', user_id % 5000, user_id % 700) for user_id in range(1, users + 1))
+    ))
+    await database.close()
+    baseline_path = os.path.join(directory, 'baseline.db')
+    shutil.copy(database.db_path, baseline_path)
+
+    async def run(read, update):
+        waits = []
+
+        async def reader():
+            for _ in range(rounds):
+                await read()
+
+        async def writer(user_id):
+            for _ in range(rounds):
+                started = time.perf_counter()
+                await update(user_id)
+                waits.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(reader() for _ in range(clients)), *(writer(i + 1) for i in range(clients)))
+        return time.perf_counter() - started, statistics.median(waits)
+
+    # Before: every query shared the one connection, so a write queued behind every scan
+    conn = await aiosqlite.connect(baseline_path)
+    await conn.execute('PRAGMA journal_mode=DELETE')
+
+    async def read():
+        cursor = await conn.execute(scan)
+        await cursor.fetchall()
+
+    async def update(user_id):
+        await conn.execute('UPDATE users SET balance = balance + 1 WHERE user_id = ?', (user_id,))
+        await conn.execute(
+            'INSERT INTO transactions (user_id, amount, type, description) VALUES (?, ?, ?, ?)',
+            (user_id, 1, 'bench', 'bench')
+        )
+        await conn.commit()
+
+    try:
+        results = [('single', *await run(read, update))]
+    finally:
+        await conn.close()
+
+    await database.connect()
+    try:
+        results.append(('wal+pool', *await run(
+            lambda: database.fetchall(scan),
+            lambda user_id: database.update_user_balance(user_id, 1, 'bench', 'bench')
+        )))
+    finally:
+        await database.close()
+        shutil.rmtree(directory)
+    print(f'{users:,} users, {clients} readers x {rounds} scans, {clients} writers x {rounds} updates')
+    for name, wall, write_p50 in results:
+        print(f'{name:<10} wall {wall:6.2f}s  write p50 {write_p50 * 1000:7.1f} ms')
+
+if __name__ == '__main__':
+    # python -m bench.db xp | pool
+    if sys.argv[1:] == ['xp']:
+        if not asyncio.run(bench_xp()):
+            print('FAIL: buffered XP left different rows than per-message commits')
+            sys.exit(1)
+    elif sys.argv[1:] == ['pool']:
+        asyncio.run(bench_pool())
+    else:
+        print('usage: python -m bench.db xp | pool')
+        sys.exit(2)
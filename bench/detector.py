@@ -0,0 +1,39 @@
+import random
+import sys
+import time
+from utils.detector import NukeDetector
+
+def benchmark(rate=100000, seconds=3, guilds=1000, actors=50):
+    """Replay rate synthetic events per second of simulated time and report throughput"""
+    thresholds = {
+        "channel_delete": (5, 10),
+        "role_delete": (5, 10),
+        "webhook_create": (3, 10),
+        "member_prune": (1, 60),
+    }
+    actions = list(thresholds)
+    rng = random.Random(1)
+    total = rate * seconds
+    events = [
+        (i / rate, rng.randrange(guilds), rng.randrange(actors), rng.choice(actions))
+        for i in range(total)
+    ]
+
+    detector = NukeDetector(thresholds)
+    record = detector.record
+    started = time.perf_counter()
+    for now, guild_id, actor_id, action in events:
+        record(guild_id, actor_id, action, now)
+    elapsed = time.perf_counter() - started
+    swept_at = time.perf_counter()
+    dropped = detector.sweep(seconds + 60)
+    swept = time.perf_counter() - swept_at
+
+    print(f"{total} events over {seconds}s simulated: {elapsed:.2f}s wall, "
+          f"{total / elapsed:,.0f} events/s ({elapsed / total * 1e6:.2f}us each)")
+    print(f"{detector.triggers} triggers, {dropped} rings swept in {swept * 1000:.1f}ms")
+    print("keeps up with" if elapsed <= seconds else "falls behind", f"{rate:,} events/s")
+
+if __name__ == "__main__":
+    # python -m bench.detector [events per second] [seconds]
+    benchmark(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,69 @@
+import asyncio
+import sys
+import threading
+import time
+from collections import Counter
+from config import EXTRACT_PER_GUILD, EXTRACT_WORKERS
+from utils.extractor import Extractor
+from utils.metrics import LoopLagMonitor
+
+# Benchmark: event loop lag while lookups that block for a second are running
+
+GUILDS = 3
+
+class SlowExtract:
+    """Blocking stand-in for ytdl_extract that records how many lookups ran at once"""
+
+    def __init__(self, seconds=1.0):
+        self.seconds = seconds
+        self.lock = threading.Lock()
+        self.running = Counter()
+        self.peak = 0
+        self.guild_peak = 0
+
+    def __call__(self, query, options):
+        guild_id = query.split(":")[0]
+        with self.lock:
+            self.running[guild_id] += 1
+            self.peak = max(self.peak, sum(self.running.values()))
+            self.guild_peak = max(self.guild_peak, self.running[guild_id])
+        time.sleep(self.seconds)
+        with self.lock:
+            self.running[guild_id] -= 1
+        return {"title": query}
+
+async def _measure(lookups, inline):
+    extract = SlowExtract()
+    monitor = LoopLagMonitor(interval=0.01)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    if inline:
+        # What Music.play did before the worker pool
+        for i in range(lookups):
+            extract(f"{i % GUILDS}:song {i}", {})
+            await asyncio.sleep(0)
+    else:
+        # The pool and per-guild limits from config, as the music cog builds it
+        extractor = Extractor({}, extract=extract)
+        await asyncio.gather(*(extractor.extract(i % GUILDS, f"{i % GUILDS}:song {i}") for i in range(lookups)))
+        extractor.shutdown()
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(0.05)
+    monitor.stop()
+    return elapsed, monitor.worst, extract
+
+def benchmark(lookups=10, max_lag=0.1):
+    """Fire lookups at once inline and through Extractor; True if Extractor kept lag and concurrency in bounds"""
+    print(f"{lookups} lookups across {GUILDS} guilds, EXTRACT_WORKERS={EXTRACT_WORKERS}, EXTRACT_PER_GUILD={EXTRACT_PER_GUILD}")
+    for name, inline in (("inline", True), ("extractor", False)):
+        elapsed, worst, extract = asyncio.run(_measure(lookups, inline))
+        print(f"{name:<10} {elapsed:6.2f}s  worst loop lag {worst * 1000:8.1f} ms  "
+              f"peak {extract.peak} running, {extract.guild_peak} per guild")
+    return worst <= max_lag and extract.peak <= EXTRACT_WORKERS and extract.guild_peak <= EXTRACT_PER_GUILD
+
+if __name__ == "__main__":
+    # python -m bench.extractor [lookups]
+    if not benchmark(*(int(arg) for arg in sys.argv[1:2])):
+        print("FAIL: the event loop stalled or Extractor ran more lookups at once than configured")
+        sys.exit(1)
@@ -0,0 +1,116 @@
+import asyncio
+import gc
+import os
+import subprocess
+import sys
+import discord
+from utils.gateway import BASE_INTENTS, build_intents, gateway_settings, member_cache_flags
+
+# Benchmark: replay one large guild's startup traffic under each policy
+
+BENCH_POLICIES = {
+    # What main.py used to run: every intent, every member, every presence
+    "legacy": (BASE_INTENTS + ("members", "presences", "voice_states", "moderation"), "all", True),
+    "all": (None, "all", True),
+    "all-nochunk": (None, "all", False),
+    "cogs": (None, "cogs", False),
+    "none": (None, "none", False),
+}
+BENCH_COGS = ['cogs.moderation', 'cogs.utility', 'cogs.economy', 'cogs.games', 'cogs.level', 'cogs.music', 'cogs.antinuke']
+CHUNK_SIZE = 1000
+BOT_INDEX = 10**7
+
+def _user(i):
+    return {"id": str(10**17 + i), "username": f"user{i}", "discriminator": "0",
+            "global_name": f"User {i}", "avatar": f"{i:032x}"}
+
+def _member(i, roles):
+    return {"user": _user(i), "nick": None, "roles": roles, "joined_at": "2024-01-01T00:00:00+00:00",
+            "deaf": False, "mute": False, "flags": 0}
+
+def _presence(i):
+    return {"user": {"id": str(10**17 + i)}, "status": "online", "client_status": {"desktop": "online"},
+            "activities": [{"name": "Some Game", "type": 0, "created_at": 0}]}
+
+def _guild_create(guild_id, members, channels, roles, in_voice, presences):
+    """GUILD_CREATE for a large guild: Discord sends only the bot and members in voice"""
+    role_ids = [str(guild_id + 1 + i) for i in range(roles)]
+    voice_id = str(guild_id + 10**6)
+    voice = [_member(i, role_ids[:2]) for i in range(in_voice)]
+    return {
+        "id": str(guild_id), "name": "Big Guild", "owner_id": str(10**17), "large": True,
+        "member_count": members, "features": [], "emojis": [], "stickers": [],
+        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0}]
+                 + [{"id": r, "name": f"role{i}", "permissions": "0", "position": i + 1}
+                    for i, r in enumerate(role_ids)],
+        "channels": [{"id": voice_id, "type": 2, "name": "voice", "position": 0,
+                      "bitrate": 64000, "user_limit": 0}]
+                    + [{"id": str(guild_id + 10**6 + 1 + i), "type": 0, "name": f"chan{i}", "position": i + 1}
+                       for i in range(channels)],
+        "voice_states": [{"user_id": m["user"]["id"], "channel_id": voice_id, "session_id": "x",
+                          "deaf": False, "mute": False, "self_deaf": False, "self_mute": False,
+                          "self_video": False, "suppress": False} for m in voice],
+        "members": voice + [_member(BOT_INDEX, [])],
+        "presences": [_presence(i) for i in range(in_voice)] if presences else [],
+    }
+
+async def _replay(policy, members, channels, roles, in_voice, online):
+    intent_names, cache_policy, chunk = BENCH_POLICIES[policy]
+    if intent_names is None:
+        settings = gateway_settings(BENCH_COGS, cache_policy, chunk)
+    else:
+        intents = build_intents(intent_names)
+        settings = {"intents": intents, "member_cache_flags": member_cache_flags(cache_policy, intents),
+                    "chunk_guilds_at_startup": chunk}
+    client = discord.Client(**settings)
+    state = client._connection
+    presences = settings["intents"].presences
+    guild_id = 10**15
+
+    gc.collect()
+    before = _rss()
+    state.parse_ready({"user": _user(BOT_INDEX) | {"bot": True}, "guilds": [{"id": str(guild_id), "unavailable": True}],
+                       "session_id": "x", "resume_gateway_url": "wss://x"})
+    state._ready_task.cancel()
+    state.parse_guild_create(_guild_create(guild_id, members, channels, roles, in_voice, presences))
+    guild = client.get_guild(guild_id)
+
+    if chunk:
+        # What chunk_guild() sets up before asking the gateway for the member list
+        request = discord.state.ChunkRequest(guild_id, 0, asyncio.get_running_loop(), state._get_guild,
+                                             cache=state.member_cache_flags.joined)
+        state._chunk_requests[guild_id] = request
+        count = -(-members // CHUNK_SIZE)
+        for index in range(count):
+            ids = range(index * CHUNK_SIZE, min(members, (index + 1) * CHUNK_SIZE))
+            state.parse_guild_members_chunk({
+                "guild_id": str(guild_id), "nonce": request.nonce, "chunk_index": index, "chunk_count": count,
+                "members": [_member(i, []) for i in ids],
+                "presences": [_presence(i) for i in ids if i % 100 < online] if presences else [],
+            })
+    gc.collect()
+    after = _rss()
+    print(f"{policy:<12} cached members {len(guild._members):>7,}  users {len(state._users):>7,}  "
+          f"rss +{(after - before) / 2**20:7.1f} MiB  ({after / 2**20:.1f} MiB total)")
+
+def _rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def benchmark(members=100000, channels=500, roles=200, in_voice=300, online=30):
+    """Replay a large guild's READY, GUILD_CREATE and member chunks once per policy.
+
+    Each policy runs in its own interpreter so resident memory is not
+    shared between them. online is the percentage of members with a presence.
+    """
+    print(f"{members:,} members, {channels} channels, {roles} roles, {in_voice} in voice, {online}% online")
+    for policy in BENCH_POLICIES:
+        subprocess.run([sys.executable, "-m", "bench.gateway", "replay", policy,
+                        str(members), str(channels), str(roles), str(in_voice), str(online)], check=True)
+
+if __name__ == "__main__":
+    # python -m bench.gateway [members]
+    if sys.argv[1:2] == ["replay"]:
+        asyncio.run(_replay(sys.argv[2], *(int(arg) for arg in sys.argv[3:8])))
+    else:
+        benchmark(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,174 @@
+import asyncio
+import sys
+import time
+from collections import defaultdict
+import discord
+from utils.rollback import Rollback, RollbackExecutor, pack, snapshot_guild, unpack
+
+class FakeAPI:
+    """Stand-in for Discord's REST API: fixed latency, per-bucket and global rate limits"""
+
+    def __init__(self, latency=0.05, bucket_limit=10, bucket_reset=1.0, global_limit=50):
+        self.latency = latency
+        self.bucket_limit = bucket_limit
+        self.bucket_reset = bucket_reset
+        self.global_limit = global_limit
+        self.buckets = defaultdict(list)
+        self.calls = 0
+
+    async def _wait(self, sent, limit, reset):
+        while True:
+            now = time.monotonic()
+            sent[:] = [t for t in sent if now - t < reset]
+            if len(sent) < limit:
+                sent.append(now)
+                return
+            await asyncio.sleep(sent[0] + reset - now)
+
+    async def call(self, bucket):
+        # Like discord.py, wait out an exhausted bucket instead of failing
+        await self._wait(self.buckets[bucket], self.bucket_limit, self.bucket_reset)
+        await self._wait(self.buckets[None], self.global_limit, 1.0)
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+
+class FakeObject:
+    next_id = 1 << 40
+
+    def __init__(self, guild, **fields):
+        FakeObject.next_id += 1
+        self.id = FakeObject.next_id
+        self.guild = guild
+        self.created_at = discord.utils.utcnow()
+        self.managed = False
+        self.overwrites = {}
+        self.__dict__.update(fields)
+
+class FakeRole(FakeObject):
+    def is_default(self):
+        return self.id == self.guild.id
+
+    async def edit(self, name, permissions):
+        await self.guild.api.call(("PATCH", "role", self.guild.id))
+        self.name, self.permissions = name, permissions
+
+    async def delete(self):
+        await self.guild.api.call(("DELETE", "role", self.guild.id))
+        self.guild.roles.remove(self)
+
+class FakeChannel(FakeObject):
+    async def edit(self, name, overwrites):
+        await self.guild.api.call(("PATCH", "channel", self.id))
+        self.name, self.overwrites = name, overwrites
+
+    async def delete(self):
+        await self.guild.api.call(("DELETE", "channel", self.id))
+        self.guild.channels.remove(self)
+
+class FakeGuild:
+    def __init__(self, api, roles, channels):
+        self.api = api
+        self.id = 1
+        self.roles = [FakeRole(self, name="@everyone", permissions=discord.Permissions(0), colour=discord.Colour(0),
+                               hoist=False, mentionable=False, position=0)]
+        self.roles[0].id = self.id
+        self.channels = []
+        for i in range(roles):
+            self._add_role(name=f"role-{i}", permissions=discord.Permissions(1 << (i % 30)),
+                           colour=discord.Colour(i), hoist=False, mentionable=False, position=i + 1)
+        category = self._add_channel(discord.ChannelType.category, name="general", category_id=None, position=0)
+        for i in range(channels):
+            overwrites = {discord.Object(10 + i): discord.PermissionOverwrite(send_messages=False)} if i % 5 == 0 else {}
+            self._add_channel(discord.ChannelType.text, name=f"channel-{i}", category_id=category.id,
+                              position=i + 1, overwrites=overwrites)
+
+    def _add_role(self, **fields):
+        role = FakeRole(self, **fields)
+        self.roles.append(role)
+        return role
+
+    def _add_channel(self, kind, **fields):
+        channel = FakeChannel(self, type=kind, topic=None, nsfw=False, slowmode_delay=0,
+                              bitrate=None, user_limit=None, **fields)
+        self.channels.append(channel)
+        return channel
+
+    def get_role(self, role_id):
+        return next((role for role in self.roles if role.id == role_id), None)
+
+    def get_channel(self, channel_id):
+        return next((channel for channel in self.channels if channel.id == channel_id), None)
+
+    def get_member(self, member_id):
+        return None
+
+    async def create_role(self, reason=None, colour=0, **fields):
+        await self.api.call(("POST", "role", self.id))
+        return self._add_role(colour=discord.Colour(colour), position=len(self.roles), **fields)
+
+    async def create_category(self, name, reason=None, **fields):
+        await self.api.call(("POST", "channel", self.id))
+        return self._add_channel(discord.ChannelType.category, name=name, category_id=None, **fields)
+
+    async def create_text_channel(self, name, category=None, reason=None, topic=None, nsfw=False, slowmode_delay=0, **fields):
+        await self.api.call(("POST", "channel", self.id))
+        return self._add_channel(discord.ChannelType.text, name=name, category_id=category.id if category else None, **fields)
+
+    create_voice_channel = create_text_channel
+
+def nuke(guild):
+    """200 mutations: 60 channels and 20 roles deleted, 100 spam channels, 20 roles given admin.
+
+    Returns what the audit log would credit to the attacker.
+    """
+    changes = defaultdict(set)
+    for channel in [c for c in guild.channels if c.type == discord.ChannelType.text][:60]:
+        guild.channels.remove(channel)
+        changes[discord.AuditLogAction.channel_delete].add(channel.id)
+    for role in guild.roles[1:21]:
+        guild.roles.remove(role)
+        changes[discord.AuditLogAction.role_delete].add(role.id)
+    for role in guild.roles[:20]:
+        role.permissions = discord.Permissions.all()
+        changes[discord.AuditLogAction.role_update].add(role.id)
+    for i in range(100):
+        channel = guild._add_channel(discord.ChannelType.text, name=f"nuked-{i}", category_id=None, position=0)
+        changes[discord.AuditLogAction.channel_create].add(channel.id)
+    return changes
+
+def admin_work(guild):
+    """Legitimate changes made meanwhile by someone else, which the rollback must keep"""
+    guild._add_channel(discord.ChannelType.text, name="announcements", category_id=None, position=0)
+    role = guild.roles[-1]
+    role.name = "renamed"
+    channel = next(c for c in reversed(guild.channels) if c.name.startswith("channel-"))
+    channel.overwrites = {discord.Object(99): discord.PermissionOverwrite(view_channel=False)}
+    return role, channel
+
+def benchmark(concurrency=50):
+    async def restore(concurrency):
+        api = FakeAPI()
+        guild = FakeGuild(api, roles=100, channels=150)
+        saved = unpack(pack(snapshot_guild(guild)))
+        expected = snapshot_guild(guild)
+        changes = nuke(guild)
+        role, channel = admin_work(guild)
+        started = time.perf_counter()
+        succeeded, failed = await Rollback(guild, saved, changes, RollbackExecutor(concurrency)).run()
+        elapsed = time.perf_counter() - started
+        restored = (
+            len(guild.roles) == len(expected["roles"])
+            and sorted(c.name for c in guild.channels) == sorted([row[2] for row in expected["channels"]] + ["announcements"])
+            and role.name == "renamed"
+            and channel in guild.channels and discord.Object(99) in channel.overwrites
+        )
+        return elapsed, succeeded, failed, api.calls, restored, len(pack(saved))
+
+    for label, lanes in (("one call at a time", 1), (f"{concurrency} in flight", concurrency)):
+        elapsed, succeeded, failed, calls, restored, size = asyncio.run(restore(lanes))
+        print(f"{label}: {succeeded} calls ({failed} failed) in {elapsed:.2f}s, "
+              f"restored={'yes' if restored else 'no'}, snapshot {size} bytes")
+
+if __name__ == "__main__":
+    # python -m bench.rollback [max calls in flight]
+    benchmark(*(int(arg) for arg in sys.argv[1:2]))
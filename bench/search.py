@@ -0,0 +1,43 @@
+import random
+import sys
+import time
+from utils.search import SearchIndex, tokenize
+
+def benchmark(size, lookups=2000):
+    syllables = ("lo", "ra", "mi", "ka", "zu", "te", "vo", "shi", "den", "bru", "nova", "lite", "mark",
+                 "wave", "fire", "dream", "night", "storm", "heart", "echo")
+    words = [a + b + c for a in syllables for b in syllables for c in ("",) + syllables]
+    rng = random.Random(1)
+    # Word frequencies in titles are heavily skewed, like real ones
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    titles = [" ".join(rng.choices(words, weights, k=rng.randint(3, 7))) for _ in range(size)]
+
+    index = SearchIndex()
+    started = time.perf_counter()
+    index.load((f"bench:{i}", title) for i, title in enumerate(titles))
+    built = time.perf_counter() - started
+
+    queries = []
+    for _ in range(lookups):
+        tokens = tokenize(rng.choice(titles))[:3]
+        kind = rng.random()
+        if kind < 0.33:
+            tokens[-1] = tokens[-1][:3]
+        elif kind < 0.66:
+            i = rng.randrange(len(tokens[0]))
+            tokens[0] = tokens[0][:i] + tokens[0][i + 1:]
+        queries.append(" ".join(tokens))
+
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    print(f"{size} tracks, {len(index.postings)} tokens, built in {built:.2f}s")
+    print(f"search p50 {timings[len(timings) // 2] * 1000:.2f}ms, "
+          f"p99 {timings[int(len(timings) * 0.99)] * 1000:.2f}ms over {lookups} queries")
+
+if __name__ == "__main__":
+    # python -m bench.search [track count]
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -1,15 +1,125 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from utils.utils import create_embed, create_error_embed, create_success_embed
+from utils.detector import NukeDetector
+from utils.auditlog import AuditLogIndex
+from utils.rollback import Rollback, RollbackExecutor, snapshot_guild, pack, unpack
+from utils.alerts import AlertSender
 from database.database import db
+from config import (
+    ANTINUKE_THRESHOLDS, ANTINUKE_SWEEP_INTERVAL, ANTINUKE_SNAPSHOT_INTERVAL,
+    ANTINUKE_ROLLBACK_WINDOW, ANTINUKE_ROLLBACK_CONCURRENCY,
+)
 import asyncio
 import time
 
+# Bans and audit-log entries come with the moderation intent, role changes with members
+INTENTS = ("members", "moderation")
+# Triggers that can leave structural damage behind for a rollback to undo
+ROLLBACK_ACTIONS = {"channel_create", "channel_delete", "role_create", "role_delete"}
+
 class Antinuke(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.raid_mode = {}
+        # Guild ids with antinuke on, and guild_id -> set of whitelisted user ids;
+        # both mirror the database and are written through on change
+        self.raid_mode = set()
         self.protected_users = {}
+        self.detector = NukeDetector(ANTINUKE_THRESHOLDS)
+        self.audit_log = AuditLogIndex()
+        # guild_id -> time of the last trigger; snapshots pause while a guild is under attack
+        self.last_trigger = {}
+        self.rollbacks = {}
+        # guild_id -> ids of banned users whose changes the next rollback pass undoes
+        self.rollback_actors = {}
+        self.alerts = AlertSender(bot, "🛡️ Antinuke")
+        self.sweep_counters.start()
+        self.take_snapshots.start()
+    
+    async def cog_load(self):
+        self.raid_mode, self.protected_users = await db.load_security()
+    
+    def cog_unload(self):
+        self.sweep_counters.cancel()
+        self.take_snapshots.cancel()
+        self.alerts.close()
+    
+    @tasks.loop(seconds=ANTINUKE_SWEEP_INTERVAL)
+    async def sweep_counters(self):
+        self.detector.sweep()
+    
+    @tasks.loop(seconds=ANTINUKE_SNAPSHOT_INTERVAL)
+    async def take_snapshots(self):
+        for guild_id in list(self.raid_mode):
+            guild = self.bot.get_guild(guild_id)
+            if guild:
+                await self.snapshot(guild)
+    
+    @take_snapshots.before_loop
+    async def before_take_snapshots(self):
+        await self.bot.wait_until_ready()
+    
+    async def snapshot(self, guild):
+        # Never overwrite the last good snapshot with a half-nuked guild
+        if guild.id in self.rollbacks:
+            return
+        if time.time() - self.last_trigger.get(guild.id, 0) < ANTINUKE_SNAPSHOT_INTERVAL:
+            return
+        await db.save_snapshot(guild.id, pack(snapshot_guild(guild)))
+    
+    async def rollback(self, guild):
+        """Undo the structural changes banned users made since the last snapshot"""
+        try:
+            # Users banned while a pass runs are picked up by the next one
+            while self.rollback_actors.get(guild.id):
+                actors = self.rollback_actors.pop(guild.id)
+                row = await db.get_snapshot(guild.id)
+                if row:
+                    taken_at, data = row
+                    saved = unpack(data)
+                else:
+                    taken_at, saved = 0, {"roles": [], "channels": []}
+                since = max(taken_at, self.last_trigger[guild.id] - ANTINUKE_ROLLBACK_WINDOW)
+                changes = {}
+                for actor_id in actors:
+                    for action, targets in (await self.audit_log.changes_by(guild, actor_id, since)).items():
+                        changes.setdefault(action, set()).update(targets)
+                started = time.perf_counter()
+                executor = RollbackExecutor(ANTINUKE_ROLLBACK_CONCURRENCY)
+                succeeded, failed = await Rollback(guild, saved, changes, executor).run()
+                if succeeded or failed:
+                    self.alerts.send(
+                        guild,
+                        f"**Rollback:** reverted {succeeded} changes in {time.perf_counter() - started:.1f}s"
+                        + (f" ({failed} failed)" if failed else "")
+                    )
+        finally:
+            self.rollbacks.pop(guild.id, None)
+    
+    # Channel and permission changes can move where alerts should, or can, go
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before, after):
+        self.alerts.invalidate(after.guild.id)
+    
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before, after):
+        if before.permissions != after.permissions:
+            self.alerts.invalidate(after.guild.id)
+    
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        if after.id == self.bot.user.id and before.roles != after.roles:
+            self.alerts.invalidate(after.guild.id)
+    
+    @commands.command(name="logchannel", help="Set the channel antinuke alerts are posted in")
+    @commands.has_permissions(administrator=True)
+    async def logchannel(self, ctx, channel: discord.TextChannel):
+        if not channel.permissions_for(ctx.guild.me).send_messages:
+            await ctx.send(embed=create_error_embed(f"I can't send messages in {channel.mention}."))
+            return
+        await db.set_server(ctx.guild.id, log_channel=channel.id)
+        self.alerts.invalidate(ctx.guild.id)
+        await ctx.send(embed=create_success_embed(f"Alerts will be posted in {channel.mention}"))
     
     @commands.Cog.listener()
     async def on_ready(self):
@@ -19,150 +129,133 @@ class Antinuke(commands.Cog):
     @commands.has_permissions(administrator=True)
     async def antinuke(self, ctx, mode: str = None):
         if mode is None:
-            if ctx.guild.id in self.raid_mode:
-                status = "ENABLED" if self.raid_mode[ctx.guild.id] else "DISABLED"
-                embed = create_embed("Antinuke Status", f"Antinuke is currently **{status}**")
-            else:
-                embed = create_embed("Antinuke Status", "Antinuke is currently **DISABLED**")
+            status = "ENABLED" if ctx.guild.id in self.raid_mode else "DISABLED"
+            embed = create_embed("Antinuke Status", f"Antinuke is currently **{status}**")
             await ctx.send(embed=embed)
             return
         
         mode = mode.lower()
         if mode == "on":
-            self.raid_mode[ctx.guild.id] = True
+            await db.set_antinuke(ctx.guild.id, True)
+            self.raid_mode.add(ctx.guild.id)
+            await self.snapshot(ctx.guild)
             embed = create_success_embed("Antinuke protection is now **ENABLED**")
             await ctx.send(embed=embed)
         elif mode == "off":
-            self.raid_mode[ctx.guild.id] = False
+            await db.set_antinuke(ctx.guild.id, False)
+            self.raid_mode.discard(ctx.guild.id)
+            # Entries stop being indexed while antinuke is off, so the index would go stale
+            self.audit_log.forget(ctx.guild.id)
             embed = create_embed("Antinuke Status", "Antinuke protection is now **DISABLED**")
             await ctx.send(embed=embed)
         else:
             await ctx.send(embed=create_error_embed("Use `!antinuke on` or `!antinuke off`"))
     
+    def is_trusted(self, guild, user_id):
+        """Owner, the bot itself and whitelisted users are never acted against"""
+        return (
+            user_id == guild.owner_id
+            or user_id == self.bot.user.id
+            or user_id in self.protected_users.get(guild.id, ())
+        )
+    
+    async def record(self, guild, actor, action):
+        """Count one destructive action; return True if the actor was just punished"""
+        if guild.id not in self.raid_mode:
+            return False
+        if actor is None or self.is_trusted(guild, actor.id):
+            return False
+        if not self.detector.record(guild.id, actor.id, action):
+            return False
+        # Only members in voice are cached, so look the actor up once they trip a threshold
+        member = guild.get_member(actor.id)
+        if member is None:
+            try:
+                member = await guild.fetch_member(actor.id)
+            except discord.HTTPException:
+                pass
+        if member and member.guild_permissions.administrator:
+            self.detector.reset(guild.id, actor.id)
+            return False
+        
+        count, window = ANTINUKE_THRESHOLDS[action]
+        reason = f"{count}x {action.replace('_', ' ')} within {window}s"
+        try:
+            await guild.ban(actor, reason=f"Antinuke: {reason}")
+        except discord.HTTPException:
+            return False
+        self.detector.reset(guild.id, actor.id)
+        self.last_trigger[guild.id] = time.time()
+        if action in ROLLBACK_ACTIONS:
+            self.rollback_actors.setdefault(guild.id, set()).add(actor.id)
+            if guild.id not in self.rollbacks:
+                self.rollbacks[guild.id] = asyncio.create_task(self.rollback(guild))
+        
+        self.alerts.send(guild, f"**Banned:** {actor} ({reason})")
+        return True
+    
     @commands.Cog.listener()
     async def on_member_ban(self, guild, user):
-        if guild.id not in self.raid_mode or not self.raid_mode[guild.id]:
+        if guild.id not in self.raid_mode:
             return
-        
-        # Get audit log to find who banned
-        async for entry in guild.audit_logs(action=discord.AuditLogAction.ban, limit=1):
-            if entry.target == user:
-                moderator = entry.user
-                
-                # Check if moderator is not the owner or admin
-                if moderator.id == guild.owner_id:
-                    return
-                
-                if moderator.guild_permissions.administrator:
-                    return
-                
-                # Ban the user who banned
-                try:
-                    await guild.ban(moderator, reason="Antinuke: Unauthorized ban")
-                    embed = create_success_embed(
-                        f"Antinuke triggered!\n\n**Banned:** {moderator}\n**Reason:** Unauthorized ban attempt"
-                    )
-                    
-                    # Try to notify in a channel
-                    for channel in guild.channels:
-                        if isinstance(channel, discord.TextChannel) and channel.permissions_for(guild.me).send_messages:
-                            await channel.send(embed=embed)
-                            break
-                except:
-                    pass
+        moderator = await self.audit_log.actor(guild, discord.AuditLogAction.ban, user.id)
+        await self.record(guild, moderator, "ban")
     
     @commands.Cog.listener()
-    async def on_member_kick(self, guild, user):
-        if guild.id not in self.raid_mode or not self.raid_mode[guild.id]:
+    async def on_guild_channel_create(self, channel):
+        self.alerts.invalidate(channel.guild.id)
+        if channel.guild.id not in self.raid_mode:
             return
-        
-        async for entry in guild.audit_logs(action=discord.AuditLogAction.kick, limit=1):
-            if entry.target == user:
-                moderator = entry.user
-                
-                if moderator.id == guild.owner_id:
-                    return
-                
-                if moderator.guild_permissions.administrator:
-                    return
-                
-                try:
-                    await guild.ban(moderator, reason="Antinuke: Unauthorized kick")
-                    embed = create_success_embed(
-                        f"Antinuke triggered!\n\n**Kicked:** {moderator}\n**Reason:** Unauthorized kick attempt"
-                    )
-                    
-                    for channel in guild.channels:
-                        if isinstance(channel, discord.TextChannel) and channel.permissions_for(guild.me).send_messages:
-                            await channel.send(embed=embed)
-                            break
-                except:
-                    pass
+        creator = await self.audit_log.actor(channel.guild, discord.AuditLogAction.channel_create, channel.id)
+        await self.record(channel.guild, creator, "channel_create")
     
     @commands.Cog.listener()
-    async def on_guild_channel_create(self, channel):
-        if channel.guild.id not in self.raid_mode or not self.raid_mode[channel.guild.id]:
+    async def on_guild_channel_delete(self, channel):
+        self.alerts.invalidate(channel.guild.id)
+        if channel.guild.id not in self.raid_mode:
             return
-        
-        async for entry in channel.guild.audit_logs(action=discord.AuditLogAction.channel_create, limit=1):
-            creator = entry.user
-            
-            if creator.id == channel.guild.owner_id:
-                return
-            
-            if creator.guild_permissions.administrator:
-                return
-            
-            try:
-                await channel.delete()
-                await channel.guild.ban(creator, reason="Antinuke: Unauthorized channel creation")
-                embed = create_success_embed(
-                    f"Antinuke triggered!\n\n**User:** {creator}\n**Reason:** Unauthorized channel creation"
-                )
-                
-                for ch in channel.guild.channels:
-                    if isinstance(ch, discord.TextChannel) and ch.permissions_for(channel.guild.me).send_messages:
-                        await ch.send(embed=embed)
-                        break
-            except:
-                pass
+        deleter = await self.audit_log.actor(channel.guild, discord.AuditLogAction.channel_delete, channel.id)
+        await self.record(channel.guild, deleter, "channel_delete")
     
     @commands.Cog.listener()
     async def on_guild_role_create(self, role):
-        if role.guild.id not in self.raid_mode or not self.raid_mode[role.guild.id]:
+        if role.guild.id not in self.raid_mode:
             return
-        
-        async for entry in role.guild.audit_logs(action=discord.AuditLogAction.role_create, limit=1):
-            creator = entry.user
-            
-            if creator.id == role.guild.owner_id:
-                return
-            
-            if creator.guild_permissions.administrator:
-                return
-            
-            try:
-                await role.delete()
-                await role.guild.ban(creator, reason="Antinuke: Unauthorized role creation")
-                embed = create_success_embed(
-                    f"Antinuke triggered!\n\n**User:** {creator}\n**Reason:** Unauthorized role creation"
-                )
-                
-                for channel in role.guild.channels:
-                    if isinstance(channel, discord.TextChannel) and channel.permissions_for(role.guild.me).send_messages:
-                        await channel.send(embed=embed)
-                        break
-            except:
-                pass
+        creator = await self.audit_log.actor(role.guild, discord.AuditLogAction.role_create, role.id)
+        await self.record(role.guild, creator, "role_create")
+    
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        if role.guild.id not in self.raid_mode:
+            return
+        deleter = await self.audit_log.actor(role.guild, discord.AuditLogAction.role_delete, role.id)
+        await self.record(role.guild, deleter, "role_delete")
+    
+    @commands.Cog.listener()
+    async def on_audit_log_entry_create(self, entry):
+        if entry.guild.id not in self.raid_mode:
+            return
+        self.audit_log.add(entry)
+        # Kicks, webhook creation and prunes have no gateway event of their own
+        if entry.action == discord.AuditLogAction.kick:
+            action = "kick"
+        elif entry.action == discord.AuditLogAction.webhook_create:
+            action = "webhook_create"
+        elif entry.action == discord.AuditLogAction.member_prune:
+            action = "member_prune"
+        else:
+            return
+        actor = entry.user or discord.Object(entry.user_id)
+        await self.record(entry.guild, actor, action)
     
     @commands.command(name="whitelist", help="Whitelist a user from antinuke")
     @commands.has_permissions(administrator=True)
     async def whitelist(self, ctx, member: discord.Member):
-        if ctx.guild.id not in self.protected_users:
-            self.protected_users[ctx.guild.id] = []
+        whitelisted = self.protected_users.setdefault(ctx.guild.id, set())
         
-        if member.id not in self.protected_users[ctx.guild.id]:
-            self.protected_users[ctx.guild.id].append(member.id)
+        if member.id not in whitelisted:
+            await db.add_whitelist(ctx.guild.id, member.id)
+            whitelisted.add(member.id)
             embed = create_success_embed(f"**{member}** is now whitelisted from antinuke")
         else:
             embed = create_embed("Whitelist", f"**{member}** is already whitelisted")
@@ -172,8 +265,9 @@ class Antinuke(commands.Cog):
     @commands.command(name="unwhitelist", help="Remove user from whitelist")
     @commands.has_permissions(administrator=True)
     async def unwhitelist(self, ctx, member: discord.Member):
-        if ctx.guild.id in self.protected_users and member.id in self.protected_users[ctx.guild.id]:
-            self.protected_users[ctx.guild.id].remove(member.id)
+        if member.id in self.protected_users.get(ctx.guild.id, ()):
+            await db.remove_whitelist(ctx.guild.id, member.id)
+            self.protected_users[ctx.guild.id].discard(member.id)
             embed = create_success_embed(f"**{member}** is removed from whitelist")
         else:
             embed = create_error_embed(f"**{member}** is not in whitelist")
@@ -183,11 +277,11 @@ class Antinuke(commands.Cog):
     @commands.command(name="antinukestatus", help="Check antinuke settings")
     @commands.has_permissions(administrator=True)
     async def antinuke_status(self, ctx):
-        status = "ENABLED" if self.raid_mode.get(ctx.guild.id, False) else "DISABLED"
+        status = "ENABLED" if ctx.guild.id in self.raid_mode else "DISABLED"
         
         embed = create_embed("Antinuke Settings", f"Status: **{status}**")
         
-        whitelisted = self.protected_users.get(ctx.guild.id, [])
+        whitelisted = self.protected_users.get(ctx.guild.id)
         if whitelisted:
             whitelisted_users = []
             for user_id in whitelisted:
@@ -198,6 +292,12 @@ class Antinuke(commands.Cog):
         else:
             embed.add_field(name="Whitelisted Users", value="None")
         
+        stats = self.audit_log.stats()
+        embed.add_field(
+            name="Audit Log",
+            value=f"{stats['fetches']} requests for {stats['lookups']} lookups",
+            inline=False
+        )
         await ctx.send(embed=embed)
 
 async def setup(bot):
@@ -1,13 +1,37 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from utils.utils import create_embed, create_error_embed, create_success_embed, format_number
 from database.database import db
-from config import INITIAL_BALANCE, DAILY_BONUS
+from utils.names import name_resolver
+from config import INITIAL_BALANCE, DAILY_BONUS, LEDGER_FLUSH_INTERVAL, LEDGER_COMPACT_INTERVAL
 import datetime
 
+# balance and pay look up uncached members over the gateway
+INTENTS = ("members",)
+
 class Economy(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.flush_ledger.start()
+        self.compact_ledger.start()
+    
+    async def cog_unload(self):
+        self.flush_ledger.cancel()
+        self.compact_ledger.cancel()
+        await db.flush_ledger()
+    
+    @tasks.loop(seconds=LEDGER_FLUSH_INTERVAL)
+    async def flush_ledger(self):
+        await db.flush_ledger()
+    
+    @tasks.loop(seconds=LEDGER_COMPACT_INTERVAL)
+    async def compact_ledger(self):
+        await db.compact_ledger()
+    
+    @flush_ledger.before_loop
+    @compact_ledger.before_loop
+    async def before_ledger_tasks(self):
+        await self.bot.wait_until_ready()
     
     @commands.Cog.listener()
     async def on_ready(self):
@@ -20,7 +44,7 @@ class Economy(commands.Cog):
         
         embed = create_embed(
             f"{member}'s Balance",
-            f"Wallet: {format_number(user[3])} coins\nBank: {format_number(user[4])} coins"
+            f"Wallet: {format_number(user.balance)} coins\nBank: {format_number(user.bank)} coins"
         )
         await ctx.send(embed=embed)
     
@@ -30,7 +54,7 @@ class Economy(commands.Cog):
         
         today = datetime.datetime.now().strftime("%Y-%m-%d")
         
-        if user[11] == today:
+        if user.daily_claim == today:
             embed = create_error_embed("You have already claimed your daily bonus today!")
             await ctx.send(embed=embed)
             return
@@ -50,12 +74,19 @@ class Economy(commands.Cog):
         
         sender = await db.get_user(ctx.author.id, ctx.author.name, ctx.author.discriminator)
         
-        if sender[3] < amount:
+        if sender.balance < amount:
             await ctx.send(embed=create_error_embed("Insufficient balance!"))
             return
         
-        await db.update_user_balance(ctx.author.id, -amount, "transfer", f"Transfer to {member}")
-        await db.update_user_balance(member.id, amount, "transfer", f"Transfer from {ctx.author}")
+        await db.get_user(member.id, member.name, member.discriminator)
+        result = await db.transfer(
+            ctx.author.id, member.id, amount,
+            f"Transfer to {member}", f"Transfer from {ctx.author}"
+        )
+        
+        if result is None:
+            await ctx.send(embed=create_error_embed("Insufficient balance!"))
+            return
         
         embed = create_success_embed(
             f"You sent {format_number(amount)} coins to {member}"
@@ -63,27 +94,24 @@ class Economy(commands.Cog):
         await ctx.send(embed=embed)
     
     @commands.command(name="leaderboard", help="Show richest users")
-    async def leaderboard(self, ctx):
-        cursor = await db.db.execute(
-            "SELECT * FROM users ORDER BY balance + bank DESC LIMIT 10"
-        )
-        users = await cursor.fetchall()
+    async def leaderboard(self, ctx, page: int = 1):
+        page = max(page, 1)
+        users = db.get_balance_leaderboard(page - 1)
         
         embed = create_embed("Richest Users", "")
+        names = await name_resolver.resolve(self.bot, [user[0] for user in users], ctx.guild)
         
-        for i, user in enumerate(users, 1):
-            try:
-                member = await self.bot.fetch_user(user[0])
-                name = member.name if member else f"User {user[0]}"
-            except:
-                name = f"User {user[0]}"
-            
+        for i, (user_id, net_worth, (balance, bank)) in enumerate(users, (page - 1) * 10 + 1):
             embed.add_field(
-                name=f"#{i} {name}",
-                value=f"Wallet: {format_number(user[3])} | Bank: {format_number(user[4])}",
+                name=f"#{i} {names[user_id]}",
+                value=f"Wallet: {format_number(balance)} | Bank: {format_number(bank)}",
                 inline=False
             )
         
+        rank = db.wealth_board.rank(ctx.author.id)
+        if rank:
+            embed.set_footer(text=f"Your rank: #{rank} of {len(db.wealth_board)}")
+        
         await ctx.send(embed=embed)
 
 async def setup(bot):
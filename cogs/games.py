@@ -4,6 +4,9 @@ from utils.utils import create_embed, create_error_embed, create_success_embed,
 from database.database import db
 import random
 
+# winnings looks up uncached members over the gateway
+INTENTS = ("members",)
+
 class Games(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -20,7 +23,7 @@ class Games(commands.Cog):
         
         user = await db.get_user(ctx.author.id, ctx.author.name, ctx.author.discriminator)
         
-        if user[3] < amount:
+        if user.balance < amount:
             await ctx.send(embed=create_error_embed("Insufficient balance!"))
             return
         
@@ -35,16 +38,19 @@ class Games(commands.Cog):
         won = result == choice
         
         if won:
-            await db.update_user_balance(ctx.author.id, amount, "gambling", f"Coin flip won ({result})")
+            new_balance = await db.apply_bet(ctx.author.id, amount, amount * 2, "gambling", f"Coin flip won ({result})")
             embed = create_success_embed(
                 f"🎉 You won!\n\nYou chose **{choice}**, it was **{result}**\nYou won **{format_number(amount)}** coins!"
             )
         else:
-            await db.update_user_balance(ctx.author.id, -amount, "gambling", f"Coin flip lost ({result})")
+            new_balance = await db.apply_bet(ctx.author.id, amount, 0, "gambling", f"Coin flip lost ({result})")
             embed = create_error_embed(
                 f"😢 You lost!\n\nYou chose **{choice}**, it was **{result}**\nYou lost **{format_number(amount)}** coins!"
             )
         
+        if new_balance is None:
+            embed = create_error_embed("Insufficient balance!")
+        
         await ctx.send(embed=embed)
     
     @commands.command(name="dice", help="Roll a dice (1-6)")
@@ -55,7 +61,7 @@ class Games(commands.Cog):
         
         user = await db.get_user(ctx.author.id, ctx.author.name, ctx.author.discriminator)
         
-        if user[3] < amount:
+        if user.balance < amount:
             await ctx.send(embed=create_error_embed("Insufficient balance!"))
             return
         
@@ -79,16 +85,19 @@ class Games(commands.Cog):
         
         if won:
             winnings = amount * multiplier
-            await db.update_user_balance(ctx.author.id, winnings, "gambling", f"Dice roll won ({roll})")
+            new_balance = await db.apply_bet(ctx.author.id, amount, amount + winnings, "gambling", f"Dice roll won ({roll})")
             embed = create_success_embed(
                 f"🎲 You rolled **{roll}**\n\nYou won **{format_number(winnings)}** coins!"
             )
         else:
-            await db.update_user_balance(ctx.author.id, -amount, "gambling", f"Dice roll lost ({roll})")
+            new_balance = await db.apply_bet(ctx.author.id, amount, 0, "gambling", f"Dice roll lost ({roll})")
             embed = create_error_embed(
                 f"🎲 You rolled **{roll}**\n\nYou lost **{format_number(amount)}** coins!"
             )
         
+        if new_balance is None:
+            embed = create_error_embed("Insufficient balance!")
+        
         await ctx.send(embed=embed)
     
     @commands.command(name="trivia", help="Play a trivia game")
@@ -99,7 +108,7 @@ class Games(commands.Cog):
         
         user = await db.get_user(ctx.author.id, ctx.author.name, ctx.author.discriminator)
         
-        if user[3] < amount:
+        if user.balance < amount:
             await ctx.send(embed=create_error_embed("Insufficient balance!"))
             return
         
@@ -118,6 +127,11 @@ class Games(commands.Cog):
         
         question = random.choice(questions)
         
+        # Hold the stake for the whole question so it cannot be spent meanwhile
+        if await db.apply_bet(ctx.author.id, amount, 0, "trivia", "Trivia stake") is None:
+            await ctx.send(embed=create_error_embed("Insufficient balance!"))
+            return
+        
         embed = create_embed(
             "❓ Trivia Question",
             f"**Question:** {question['q']}\n\nYou have 15 seconds to answer!\n\nReward: **{format_number(amount * 5)}** coins"
@@ -131,12 +145,11 @@ class Games(commands.Cog):
             msg = await self.bot.wait_for("message", timeout=15.0, check=check)
             
             if msg.content.lower() in question["a"]:
-                await db.update_user_balance(ctx.author.id, amount * 5, "trivia", "Correct answer")
+                await db.apply_bet(ctx.author.id, 0, amount + amount * 5, "trivia", "Correct answer")
                 embed = create_success_embed(
                     f"✅ Correct!\n\nThe answer was **{question['a'][0]}**\nYou won **{format_number(amount * 5)}** coins!"
                 )
             else:
-                await db.update_user_balance(ctx.author.id, -amount, "trivia", "Wrong answer")
                 embed = create_error_embed(
                     f"❌ Wrong!\n\nThe answer was **{question['a'][0]}**\nYou lost **{format_number(amount)}** coins!"
                 )
@@ -144,7 +157,6 @@ class Games(commands.Cog):
             await ctx.send(embed=embed)
             
         except:
-            await db.update_user_balance(ctx.author.id, -amount, "trivia", "Timeout")
             embed = create_error_embed(
                 f"⏰ Time's up!\n\nYou lost **{format_number(amount)}** coins!"
             )
@@ -158,7 +170,7 @@ class Games(commands.Cog):
         
         user = await db.get_user(ctx.author.id, ctx.author.name, ctx.author.discriminator)
         
-        if user[3] < amount:
+        if user.balance < amount:
             await ctx.send(embed=create_error_embed("Insufficient balance!"))
             return
         
@@ -179,22 +191,36 @@ class Games(commands.Cog):
         }
         
         if choice == bot_choice:
-            await db.update_user_balance(ctx.author.id, 0, "rps", "Tie")
+            new_balance = await db.apply_bet(ctx.author.id, amount, amount, "rps", "Tie")
             embed = create_embed(
                 "🤝 It's a Tie!",
                 f"You: **{choice}**\nBot: **{bot_choice}**\n\nYour bet has been returned."
             )
         elif win_conditions[choice] == bot_choice:
-            await db.update_user_balance(ctx.author.id, amount, "rps", f"Won against {bot_choice}")
+            new_balance = await db.apply_bet(ctx.author.id, amount, amount * 2, "rps", f"Won against {bot_choice}")
             embed = create_success_embed(
                 f"🎉 You Won!\n\nYou: **{choice}**\nBot: **{bot_choice}**\n\nYou won **{format_number(amount)}** coins!"
             )
         else:
-            await db.update_user_balance(ctx.author.id, -amount, "rps", f"Lost against {bot_choice}")
+            new_balance = await db.apply_bet(ctx.author.id, amount, 0, "rps", f"Lost against {bot_choice}")
             embed = create_error_embed(
                 f"😢 You Lost!\n\nYou: **{choice}**\nBot: **{bot_choice}**\n\nYou lost **{format_number(amount)}** coins!"
             )
         
+        if new_balance is None:
+            embed = create_error_embed("Insufficient balance!")
+        
+        await ctx.send(embed=embed)
+    
+    @commands.command(name="winnings", help="Show your net gambling result this week")
+    async def winnings(self, ctx, member: discord.Member = None):
+        member = member or ctx.author
+        net = await db.get_ledger_total(member.id, ["gambling", "rps", "trivia"], days=7)
+        
+        if net >= 0:
+            embed = create_embed(f"{member}'s Winnings", f"Net result this week: **+{format_number(net)}** coins")
+        else:
+            embed = create_embed(f"{member}'s Winnings", f"Net result this week: **-{format_number(-net)}** coins")
         await ctx.send(embed=embed)
 
 async def setup(bot):
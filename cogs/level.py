@@ -1,11 +1,29 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from utils.utils import create_embed, create_error_embed, create_success_embed, format_number
 from database.database import db
+from utils.names import name_resolver
+from config import XP_FLUSH_INTERVAL
+
+# rank and level look up uncached members over the gateway
+INTENTS = ("members",)
 
 class Level(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.flush_xp.start()
+    
+    async def cog_unload(self):
+        self.flush_xp.cancel()
+        await db.flush_xp()
+    
+    @tasks.loop(seconds=XP_FLUSH_INTERVAL)
+    async def flush_xp(self):
+        await db.flush_xp()
+    
+    @flush_xp.before_loop
+    async def before_flush_xp(self):
+        await self.bot.wait_until_ready()
     
     @commands.Cog.listener()
     async def on_ready(self):
@@ -35,9 +53,9 @@ class Level(commands.Cog):
         member = member or ctx.author
         user = await db.get_user(member.id, member.name, member.discriminator)
         
-        level = user[7]
-        xp = user[6]
-        total_xp = user[5]
+        level = user.level
+        xp = user.xp
+        total_xp = user.total_xp
         
         next_level_xp = level * 100 * level
         current_level_xp = (level - 1) * 100 * (level - 1) if level > 1 else 0
@@ -64,27 +82,24 @@ class Level(commands.Cog):
         await self.rank(ctx, member)
     
     @commands.command(name="levelboard", help="Show top users by level")
-    async def levelboard(self, ctx):
-        cursor = await db.db.execute(
-            "SELECT * FROM users ORDER BY total_xp DESC LIMIT 10"
-        )
-        users = await cursor.fetchall()
+    async def levelboard(self, ctx, page: int = 1):
+        page = max(page, 1)
+        users = db.get_xp_leaderboard(page - 1)
         
         embed = create_embed("Level Leaderboard", "")
+        names = await name_resolver.resolve(self.bot, [user[0] for user in users], ctx.guild)
         
-        for i, user in enumerate(users, 1):
-            try:
-                member = await self.bot.fetch_user(user[0])
-                name = member.name if member else f"User {user[0]}"
-            except:
-                name = f"User {user[0]}"
-            
+        for i, (user_id, total_xp, level) in enumerate(users, (page - 1) * 10 + 1):
             embed.add_field(
-                name=f"#{i} {name}",
-                value=f"Level: {user[7]} | XP: {format_number(user[5])}",
+                name=f"#{i} {names[user_id]}",
+                value=f"Level: {level} | XP: {format_number(total_xp)}",
                 inline=False
             )
         
+        rank = db.xp_board.rank(ctx.author.id)
+        if rank:
+            embed.set_footer(text=f"Your rank: #{rank} of {len(db.xp_board)}")
+        
         await ctx.send(embed=embed)
 
 async def setup(bot):
@@ -1,11 +1,27 @@
 import discord
+import asyncio
 from discord.ext import commands
 from database.database import db
+from utils.names import name_resolver
+from utils.overwrites import apply_overwrites, missing_channels
+from utils.purge import purge_messages
+from config import PURGE_MAX_AMOUNT
 from utils.utils import create_embed, create_error_embed, create_success_embed, can_execute_action, ConfirmView
 
+MUTED_OVERWRITE = discord.PermissionOverwrite(send_messages=False, add_reactions=False)
+
+# Kick, ban and mute targets that are not cached are looked up over the gateway
+INTENTS = ("members",)
+
 class Moderation(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # guild_id -> running muted role setup
+        self.mute_setups = {}
+        # guild_id -> ids of channels the last setup could not update; only !mutesetup retries them
+        self.mute_failed = {}
+        # channel_id -> cancel event of the purge running there
+        self.purges = {}
     
     @commands.Cog.listener()
     async def on_ready(self):
@@ -101,15 +117,11 @@ class Moderation(commands.Cog):
             await ctx.send(embed=create_error_embed(message))
             return
         
-        muted_role = discord.utils.get(ctx.guild.roles, name="Muted")
-        if not muted_role:
-            try:
-                muted_role = await ctx.guild.create_role(name="Muted", reason="Creating muted role")
-                for channel in ctx.guild.channels:
-                    await channel.set_permissions(muted_role, send_messages=False, add_reactions=False)
-            except:
-                await ctx.send(embed=create_error_embed("Cannot create muted role."))
-                return
+        try:
+            muted_role = await self.get_muted_role(ctx.guild, create=True)
+        except discord.HTTPException:
+            await ctx.send(embed=create_error_embed("Cannot create muted role."))
+            return
         
         try:
             await member.add_roles(muted_role, reason=f"{ctx.author}: {reason}")
@@ -125,11 +137,91 @@ class Moderation(commands.Cog):
             
         except discord.Forbidden:
             await ctx.send(embed=create_error_embed("Cannot add muted role to user."))
+            return
+        
+        # New channels, or a setup that was interrupted, still need the overwrite
+        if ctx.guild.id not in self.mute_setups and self.channels_to_mute(ctx.guild, muted_role):
+            self.mute_setups[ctx.guild.id] = asyncio.create_task(self.setup_muted_role(ctx, muted_role))
+    
+    def channels_to_mute(self, guild, muted_role, retry=False):
+        channels = missing_channels(guild, muted_role, MUTED_OVERWRITE)
+        if retry:
+            return channels
+        failed = self.mute_failed.get(guild.id, ())
+        return [channel for channel in channels if channel.id not in failed]
+    
+    async def get_muted_role(self, guild, create=False):
+        """Return the guild's muted role from servers.muted_role, creating it if asked"""
+        server = await db.get_server(guild.id)
+        role = guild.get_role(server.muted_role) if server and server.muted_role else None
+        if role is None:
+            # Guilds set up before the id was stored
+            role = discord.utils.get(guild.roles, name="Muted")
+            if role is None and create:
+                role = await guild.create_role(name="Muted", reason="Creating muted role")
+            if role is not None:
+                await db.set_server(guild.id, muted_role=role.id)
+        return role
+    
+    async def setup_muted_role(self, ctx, muted_role, retry=False):
+        """Apply the muted overwrite to every channel still missing it, reporting progress"""
+        try:
+            channels = self.channels_to_mute(ctx.guild, muted_role, retry)
+            if retry:
+                self.mute_failed.pop(ctx.guild.id, None)
+            if not channels:
+                return 0, []
+            message = await ctx.send(embed=create_embed(
+                "Muted Role Setup", f"Updating {len(channels)} channels..."
+            ))
+            
+            async def progress(done, failed, total):
+                text = f"Updated **{done}/{total}** channels"
+                if failed:
+                    text += f" ({failed} failed)"
+                try:
+                    await message.edit(embed=create_embed("Muted Role Setup", text))
+                except discord.HTTPException:
+                    pass
+            
+            done, failed = await apply_overwrites(channels, muted_role, MUTED_OVERWRITE, progress)
+            if failed:
+                self.mute_failed.setdefault(ctx.guild.id, set()).update(channel.id for channel in failed)
+                names = ", ".join(channel.name for channel in failed[:10])
+                await ctx.send(embed=create_error_embed(
+                    f"Could not update {len(failed)} channels: {names}\nRun `!mutesetup` to retry them."
+                ))
+            return done, failed
+        finally:
+            self.mute_setups.pop(ctx.guild.id, None)
+    
+    @commands.command(name="mutesetup", help="Apply the muted role to every channel")
+    @commands.has_permissions(manage_roles=True)
+    async def mutesetup(self, ctx):
+        if ctx.guild.id in self.mute_setups:
+            await ctx.send(embed=create_error_embed("Muted role setup is already running."))
+            return
+        try:
+            muted_role = await self.get_muted_role(ctx.guild, create=True)
+        except discord.HTTPException:
+            await ctx.send(embed=create_error_embed("Cannot create muted role."))
+            return
+        
+        task = self.mute_setups[ctx.guild.id] = asyncio.create_task(self.setup_muted_role(ctx, muted_role, retry=True))
+        done, failed = await task
+        locked = [channel for channel in ctx.guild.channels if not channel.permissions_for(ctx.guild.me).manage_roles]
+        if locked:
+            names = ", ".join(channel.name for channel in locked[:10])
+            await ctx.send(embed=create_error_embed(
+                f"Skipped {len(locked)} channels where I can't manage permissions: {names}"
+            ))
+        elif not failed:
+            await ctx.send(embed=create_success_embed(f"Muted role is set up in every channel ({done} updated)."))
     
     @commands.command(name="unmute", help="Unmute a user")
     @commands.has_permissions(manage_roles=True)
     async def unmute(self, ctx, member: discord.Member):
-        muted_role = discord.utils.get(ctx.guild.roles, name="Muted")
+        muted_role = await self.get_muted_role(ctx.guild)
         if not muted_role:
             await ctx.send(embed=create_error_embed("Muted role not found."))
             return
@@ -172,8 +264,9 @@ class Moderation(commands.Cog):
             return
         
         embed = create_embed(f"Warnings for {member}", f"Total warnings: {len(warnings)}")
+        mods = await name_resolver.resolve(self.bot, [warning[2] for warning in warnings[:10] if warning[2]], ctx.guild)
         for i, warning in enumerate(warnings[:10], 1):
-            mod = await self.bot.fetch_user(warning[2]) if warning[2] else "Unknown"
+            mod = mods[warning[2]] if warning[2] else "Unknown"
             embed.add_field(
                 name=f"Warning #{i}",
                 value=f"Reason: {warning[3]}\nModerator: {mod}\nDate: {warning[5]}",
@@ -182,15 +275,18 @@ class Moderation(commands.Cog):
         
         await ctx.send(embed=embed)
     
-    @commands.command(name="purge", help="Delete multiple messages")
-    @commands.has_permissions(manage_messages=True)
-    async def purge(self, ctx, amount: int = 10):
+    async def run_purge(self, ctx, amount, check=None, label="messages"):
+        """Stream-delete up to amount matching messages above the command, with progress"""
         if amount < 1:
             await ctx.send(embed=create_error_embed("Amount must be at least 1."))
             return
         
-        if amount > 100:
-            await ctx.send(embed=create_error_embed("Maximum amount is 100."))
+        if amount > PURGE_MAX_AMOUNT:
+            await ctx.send(embed=create_error_embed(f"Maximum amount is {PURGE_MAX_AMOUNT}."))
+            return
+        
+        if ctx.channel.id in self.purges:
+            await ctx.send(embed=create_error_embed("A purge is already running in this channel."))
             return
         
         # Delete the command message first
@@ -199,65 +295,76 @@ class Moderation(commands.Cog):
         except:
             pass
         
-        # Purge messages
-        deleted = await ctx.channel.purge(limit=amount)
+        cancel = self.purges[ctx.channel.id] = asyncio.Event()
+        status = None
+        
+        async def progress(stats):
+            nonlocal status
+            embed = create_embed(
+                "Purging",
+                f"Deleted **{stats.deleted}** {label} so far ({stats.scanned} checked)\nUse `!purgestop` to stop."
+            )
+            try:
+                if status is None:
+                    status = await ctx.send(embed=embed)
+                else:
+                    await status.edit(embed=embed)
+            except discord.HTTPException:
+                pass
         
-        # Send confirmation
-        embed = create_success_embed(f"Successfully deleted **{len(deleted)}** messages")
+        try:
+            # Only messages older than the command, so the progress message is never purged
+            stats = await purge_messages(ctx.channel, amount, check, before=ctx.message, cancel=cancel, progress=progress)
+        finally:
+            self.purges.pop(ctx.channel.id, None)
+        
+        text = f"Successfully deleted **{stats.deleted}** {label}"
+        if stats.failed:
+            text += f" ({stats.failed} could not be deleted)"
+        if stats.cancelled:
+            text += " before the purge was stopped"
+        embed = create_success_embed(text)
+        
+        if status:
+            try:
+                await status.delete()
+            except discord.HTTPException:
+                pass
         confirmation = await ctx.send(embed=embed)
         
         # Delete confirmation after 3 seconds
         await confirmation.delete(delay=3)
     
+    @commands.command(name="purge", help="Delete multiple messages")
+    @commands.has_permissions(manage_messages=True)
+    async def purge(self, ctx, amount: int = 10):
+        await self.run_purge(ctx, amount)
+    
     @commands.command(name="purgeuser", help="Delete messages from a specific user")
     @commands.has_permissions(manage_messages=True)
     async def purgeuser(self, ctx, member: discord.Member, amount: int = 10):
-        if amount < 1:
-            await ctx.send(embed=create_error_embed("Amount must be at least 1."))
-            return
-        
-        if amount > 100:
-            await ctx.send(embed=create_error_embed("Maximum amount is 100."))
-            return
-        
-        try:
-            await ctx.message.delete()
-        except:
-            pass
-        
         def check(m):
             return m.author == member
         
-        deleted = await ctx.channel.purge(limit=amount, check=check)
-        
-        embed = create_success_embed(f"Deleted **{len(deleted)}** messages from **{member}**")
-        confirmation = await ctx.send(embed=embed)
-        await confirmation.delete(delay=3)
+        await self.run_purge(ctx, amount, check, f"messages from **{member}**")
     
     @commands.command(name="purgebots", help="Delete all bot messages")
     @commands.has_permissions(manage_messages=True)
     async def purgebots(self, ctx, amount: int = 10):
-        if amount < 1:
-            await ctx.send(embed=create_error_embed("Amount must be at least 1."))
-            return
-        
-        if amount > 100:
-            await ctx.send(embed=create_error_embed("Maximum amount is 100."))
-            return
-        
-        try:
-            await ctx.message.delete()
-        except:
-            pass
-        
         def check(m):
             return m.author.bot
         
-        deleted = await ctx.channel.purge(limit=amount, check=check)
-        
-        embed = create_success_embed(f"Deleted **{len(deleted)}** bot messages")
-        confirmation = await ctx.send(embed=embed)
-        await confirmation.delete(delay=3)
+        await self.run_purge(ctx, amount, check, "bot messages")
+    
+    @commands.command(name="purgestop", help="Stop a running purge in this channel")
+    @commands.has_permissions(manage_messages=True)
+    async def purgestop(self, ctx):
+        cancel = self.purges.get(ctx.channel.id)
+        if cancel is None:
+            await ctx.send(embed=create_error_embed("No purge is running in this channel."))
+            return
+        cancel.set()
+        await ctx.message.add_reaction("✅")
 
 async def setup(bot):
     await bot.add_cog(Moderation(bot))
\ No newline at end of file
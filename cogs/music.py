@@ -1,16 +1,27 @@
-import discord
 from discord.ext import commands
 from utils.utils import create_embed, create_error_embed, create_success_embed, format_time
-import yt_dlp
+from utils.extractor import Extractor
+from utils.resolver import TrackResolver, track_from_entry, is_playlist
+from utils.player import GuildPlayer, Track
+from database.database import db
+from config import MAX_QUEUE_SIZE
+from contextlib import aclosing
 import asyncio
-from collections import deque
 import os
 
+# Voice states say who is in which channel; members in voice stay cached
+INTENTS = ("voice_states",)
+MEMBER_CACHE = ("voice",)
+
 class Music(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.queues = {}
-        self.now_playing = {}
+        self.players = {}
+        # guild_id -> text channel that gets "Now Playing" announcements
+        self.channels = {}
+        # Guilds that currently have a playlist streaming into their queue
+        self.loading_playlists = set()
+        self.restored = False
         
         self.ytdl_options = {
             "format": "bestaudio/best",
@@ -21,21 +32,108 @@ class Music(commands.Cog):
             }],
             "outtmpl": "downloads/%(extractor)s-%(id)s-%(title)s.%(ext)s",
             "quiet": True,
+            "socket_timeout": 15,
+            "default_search": "ytsearch",
         }
+        self.extractor = Extractor(self.ytdl_options)
+        self.resolver = TrackResolver(self.extractor)
         
         self.ffmpeg_options = {
             "before_options": "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5",
             "options": "-vn -filter:a \"volume=0.5\""
         }
     
+    def cog_unload(self):
+        for player in self.players.values():
+            player.release()
+        self.extractor.shutdown()
+    
     @commands.Cog.listener()
     async def on_ready(self):
         print("Music cog loaded")
+        if not self.restored:
+            self.restored = True
+            await self.resolver.load()
+            await self.restore_queues()
+    
+    async def restore_queues(self):
+        """Rebuild queues saved before the last restart; voice is reconnected lazily"""
+        players, queues = await db.load_music_state()
+        for guild_id, rows in queues.items():
+            if not self.bot.get_guild(guild_id):
+                continue
+            voice_channel_id, text_channel_id = players.get(guild_id, (None, None))
+            tracks = [Track(*row[1:], position=row[0]) for row in rows]
+            self.get_player(guild_id).restore(tracks, voice_channel_id, text_channel_id)
+            channel = self.bot.get_channel(text_channel_id) if text_channel_id else None
+            if channel:
+                self.channels[guild_id] = channel
+    
+    async def remember_channels(self, ctx):
+        player = self.get_player(ctx.guild.id)
+        self.channels[ctx.guild.id] = ctx.channel
+        voice_channel_id = ctx.guild.me.voice.channel.id if ctx.guild.me.voice else None
+        if player.voice_channel_id != voice_channel_id or player.text_channel_id != ctx.channel.id:
+            player.voice_channel_id = voice_channel_id
+            player.text_channel_id = ctx.channel.id
+            await db.set_music_player(ctx.guild.id, voice_channel_id, ctx.channel.id)
+    
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member, before, after):
+        # Resume a restored queue once someone joins the channel it was playing in
+        if member.bot or after.channel is None or after.channel == before.channel:
+            return
+        player = self.players.get(member.guild.id)
+        if not player or player.now_playing or not player.queue or member.guild.voice_client:
+            return
+        if player.voice_channel_id != after.channel.id:
+            return
+        try:
+            await after.channel.connect()
+            await player.play_next()
+        except Exception as e:
+            print(f"Could not resume music in {member.guild.id}: {e}")
+    
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        player = self.players.pop(guild.id, None)
+        if player:
+            player.release()
+        self.channels.pop(guild.id, None)
+        await db.clear_music_state(guild.id)
+    
+    def get_player(self, guild_id):
+        if guild_id not in self.players:
+            self.players[guild_id] = GuildPlayer(
+                self.bot, guild_id, self.resolver, self.ffmpeg_options,
+                on_start=self.announce_song, on_empty=self.announce_empty, on_error=self.announce_error
+            )
+        return self.players[guild_id]
     
     def get_queue(self, guild_id):
-        if guild_id not in self.queues:
-            self.queues[guild_id] = deque()
-        return self.queues[guild_id]
+        return self.get_player(guild_id).queue
+    
+    async def announce_song(self, player, song):
+        channel = self.channels.get(player.guild_id)
+        if not channel:
+            return
+        embed = create_embed(
+            "Now Playing",
+            f"**{song.title}**\nDuration: {format_time(song.duration)}\nRequested by: {song.requester_mention}"
+        )
+        if song.thumbnail:
+            embed.set_thumbnail(url=song.thumbnail)
+        await channel.send(embed=embed)
+    
+    async def announce_empty(self, player):
+        channel = self.channels.get(player.guild_id)
+        if channel:
+            await channel.send(embed=create_embed("Queue Empty", "No more songs in queue."))
+    
+    async def announce_error(self, player, song, error):
+        channel = self.channels.get(player.guild_id)
+        if channel:
+            await channel.send(embed=create_error_embed(f"Error playing song: {str(error)}"))
     
     @commands.command(name="play", help="Play a song")
     async def play(self, ctx, *, query):
@@ -53,79 +151,104 @@ class Music(commands.Cog):
         if not os.path.exists("downloads"):
             os.makedirs("downloads")
         
+        player = self.get_player(ctx.guild.id)
+        if len(player.queue) >= MAX_QUEUE_SIZE:
+            await ctx.send(embed=create_error_embed(f"The queue is full ({MAX_QUEUE_SIZE} songs)!"))
+            return
+        
+        if is_playlist(query):
+            await self.enqueue_playlist(ctx, query)
+            return
+        
         await ctx.send(embed=create_embed("Searching", f"Searching for: **{query}**"))
         
         try:
-            with yt_dlp.YoutubeDL(self.ytdl_options) as ytdl:
-                info = ytdl.extract_info(query, download=False)
-                
-                if "entries" in info:
-                    info = info[0]
-                
-                song_title = info["title"]
-                song_url = info["url"]
-                duration = info.get("duration", 0)
-                thumbnail = info.get("thumbnail", None)
-                
-                song = {
-                    "title": song_title,
-                    "url": song_url,
-                    "duration": duration,
-                    "thumbnail": thumbnail,
-                    "requester": ctx.author
-                }
-                
-                queue = self.get_queue(ctx.guild.id)
-                queue.append(song)
+            track = await self.resolver.resolve(ctx.guild.id, query)
+            
+            song_title = track.title
+            duration = track.duration
+            thumbnail = track.thumbnail
+            queue = player.queue
+            await player.enqueue([Track.from_row(track, ctx.author.id)])
+            await self.remember_channels(ctx)
+            
+            if player.now_playing is None:
+                await player.play_next()
+            else:
+                player.prefetch()
+                embed = create_embed(
+                    "Added to Queue",
+                    f"**{song_title}**\nDuration: {format_time(duration)}\nPosition: {len(queue)}"
+                )
+                if thumbnail:
+                    embed.set_thumbnail(url=thumbnail)
+                await ctx.send(embed=embed)
                 
-                if ctx.guild.id not in self.now_playing:
-                    await self.play_next(ctx)
-                else:
-                    embed = create_embed(
-                        "Added to Queue",
-                        f"**{song_title}**\nDuration: {format_time(duration)}\nPosition: {len(queue)}"
-                    )
-                    if thumbnail:
-                        embed.set_thumbnail(url=thumbnail)
-                    await ctx.send(embed=embed)
-                    
+        except asyncio.TimeoutError:
+            await ctx.send(embed=create_error_embed(f"Search timed out for: **{query}**{self.did_you_mean(query)}"))
         except Exception as e:
-            await ctx.send(embed=create_error_embed(f"Error: {str(e)}"))
+            await ctx.send(embed=create_error_embed(f"Error: {str(e)}{self.did_you_mean(query)}"))
     
-    async def play_next(self, ctx):
-        queue = self.get_queue(ctx.guild.id)
+    def did_you_mean(self, query):
+        suggestions = self.resolver.suggest(query, limit=1)
+        if not suggestions:
+            return ""
+        return f"\nDid you mean **{suggestions[0][1]}**?"
+    
+    @commands.command(name="search", help="Search songs that have been played before")
+    async def search(self, ctx, *, query):
+        suggestions = self.resolver.suggest(query)
+        if not suggestions:
+            await ctx.send(embed=create_error_embed(f"No played songs match **{query}**."))
+            return
         
-        if not queue:
-            self.now_playing.pop(ctx.guild.id, None)
-            await ctx.send(embed=create_embed("Queue Empty", "No more songs in queue."))
+        lines = [f"{i}. {title}" for i, (_, title, _) in enumerate(suggestions, 1)]
+        embed = create_embed("Search Results", "\n".join(lines))
+        corrected = suggestions[0][2]
+        if corrected.split() != query.lower().split():
+            embed.set_footer(text=f"Did you mean: {corrected}")
+        await ctx.send(embed=embed)
+    
+    async def enqueue_playlist(self, ctx, url):
+        """Stream a playlist into the queue chunk by chunk, starting playback on the first entry"""
+        if ctx.guild.id in self.loading_playlists:
+            await ctx.send(embed=create_error_embed("A playlist is already being loaded!"))
             return
         
-        song = queue.popleft()
-        self.now_playing[ctx.guild.id] = song
+        await ctx.send(embed=create_embed("Loading Playlist", f"Loading: **{url}**"))
+        self.loading_playlists.add(ctx.guild.id)
+        player = self.get_player(ctx.guild.id)
+        added = 0
+        full = False
         
         try:
-            voice_client = ctx.guild.voice_client
-            
-            audio_source = discord.FFmpegOpusAudio(song["url"], **self.ffmpeg_options)
-            
-            def after_playing(error):
-                if error:
-                    print(f"Error in playback: {error}")
-                asyncio.run_coroutine_threadsafe(self.play_next(ctx), self.bot.loop)
-            
-            voice_client.play(audio_source, after=after_playing)
-            
-            embed = create_embed(
-                "Now Playing",
-                f"**{song['title']}**\nDuration: {format_time(song['duration'])}\nRequested by: {song['requester'].mention}"
-            )
-            if song.get("thumbnail"):
-                embed.set_thumbnail(url=song["thumbnail"])
-            
-            await ctx.send(embed=embed)
-            
+            await self.remember_channels(ctx)
+            async with aclosing(self.extractor.iter_playlist(url)) as chunks:
+                async for chunk in chunks:
+                    room = MAX_QUEUE_SIZE - len(player.queue)
+                    full = len(chunk) > room
+                    tracks = [Track.from_row(track_from_entry(entry), ctx.author.id) for entry in chunk[:max(room, 0)]]
+                    await player.enqueue(tracks)
+                    added += len(tracks)
+                    
+                    if player.now_playing is None and player.queue:
+                        await player.play_next()
+                    else:
+                        player.prefetch()
+                    
+                    if full:
+                        break
+        except asyncio.TimeoutError:
+            await ctx.send(embed=create_error_embed("Timed out while loading the playlist."))
         except Exception as e:
-            await ctx.send(embed=create_error_embed(f"Error playing song: {str(e)}"))
+            await ctx.send(embed=create_error_embed(f"Error: {str(e)}"))
+        finally:
+            self.loading_playlists.discard(ctx.guild.id)
+        
+        description = f"Added **{added}** songs to the queue."
+        if full:
+            description += f"\nThe queue is full ({MAX_QUEUE_SIZE} songs), the rest of the playlist was skipped."
+        await ctx.send(embed=create_success_embed(description))
     
     @commands.command(name="skip", help="Skip current song")
     async def skip(self, ctx):
@@ -141,9 +264,8 @@ class Music(commands.Cog):
     @commands.command(name="stop", help="Stop music and clear queue")
     async def stop(self, ctx):
         if ctx.guild.voice_client:
+            await self.get_player(ctx.guild.id).clear()
             ctx.guild.voice_client.stop()
-            self.queues[ctx.guild.id] = deque()
-            self.now_playing.pop(ctx.guild.id, None)
             await ctx.send(embed=create_success_embed("Music stopped and queue cleared!"))
         else:
             await ctx.send(embed=create_error_embed("Not playing anything!"))
@@ -158,16 +280,25 @@ class Music(commands.Cog):
     
     @commands.command(name="resume", help="Resume music")
     async def resume(self, ctx):
+        player = self.get_player(ctx.guild.id)
         if ctx.guild.voice_client and ctx.guild.voice_client.is_paused():
             ctx.guild.voice_client.resume()
             await ctx.send(embed=create_embed("Resumed", "Music has been resumed."))
+        elif player.queue and not player.now_playing and ctx.author.voice:
+            # A queue restored after a restart: join the author and pick it back up
+            if not ctx.guild.voice_client:
+                await ctx.author.voice.channel.connect()
+            await self.remember_channels(ctx)
+            await ctx.send(embed=create_embed("Resumed", f"Resuming a saved queue of {len(player.queue)} songs."))
+            await player.play_next()
         else:
             await ctx.send(embed=create_error_embed("Nothing is paused!"))
     
     @commands.command(name="queue", help="Show music queue")
     async def queue(self, ctx):
-        queue = self.get_queue(ctx.guild.id)
-        now_playing = self.now_playing.get(ctx.guild.id)
+        player = self.get_player(ctx.guild.id)
+        queue = player.queue
+        now_playing = player.now_playing
         
         if not queue and not now_playing:
             await ctx.send(embed=create_embed("Queue", "Queue is empty!"))
@@ -178,14 +309,14 @@ class Music(commands.Cog):
         if now_playing:
             embed.add_field(
                 name="Now Playing",
-                value=f"**{now_playing['title']}**\nDuration: {format_time(now_playing['duration'])}",
+                value=f"**{now_playing.title}**\nDuration: {format_time(now_playing.duration)}",
                 inline=False
             )
         
         if queue:
             queue_list = []
             for i, song in enumerate(queue, 1):
-                queue_list.append(f"{i}. {song['title']} ({format_time(song['duration'])})")
+                queue_list.append(f"{i}. {song.title} ({format_time(song.duration)})")
             
             queue_text = "\n".join(queue_list[:10])
             if len(queue) > 10:
@@ -209,7 +340,7 @@ class Music(commands.Cog):
     
     @commands.command(name="np", help="Now playing")
     async def np(self, ctx):
-        now_playing = self.now_playing.get(ctx.guild.id)
+        now_playing = self.get_player(ctx.guild.id).now_playing
         
         if not now_playing:
             await ctx.send(embed=create_error_embed("Nothing is playing!"))
@@ -217,12 +348,25 @@ class Music(commands.Cog):
         
         embed = create_embed(
             "Now Playing",
-            f"**{now_playing['title']}**\nDuration: {format_time(now_playing['duration'])}\nRequested by: {now_playing['requester'].mention}"
+            f"**{now_playing.title}**\nDuration: {format_time(now_playing.duration)}\nRequested by: {now_playing.requester_mention}"
         )
-        if now_playing.get("thumbnail"):
-            embed.set_thumbnail(url=now_playing["thumbnail"])
+        if now_playing.thumbnail:
+            embed.set_thumbnail(url=now_playing.thumbnail)
         
         await ctx.send(embed=embed)
+    
+    @commands.command(name="musicstats", help="Show music cache statistics")
+    async def musicstats(self, ctx):
+        stats = self.resolver.stats()
+        transitions, average_gap, worst_gap = self.get_player(ctx.guild.id).gap_stats()
+        embed = create_embed(
+            "Music Cache",
+            f"Track lookups: {stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.0%})\n"
+            f"Search index: {stats['indexed']} tracks, {stats['index_hits']} queries answered locally\n"
+            f"Stream URLs: {stats['stream_hits']} hits / {stats['stream_misses']} misses ({stats['stream_hit_rate']:.0%})\n"
+            f"Song transitions: {transitions} (avg gap {average_gap * 1000:.0f}ms, worst {worst_gap * 1000:.0f}ms)"
+        )
+        await ctx.send(embed=embed)
 
 async def setup(bot):
     await bot.add_cog(Music(bot))
\ No newline at end of file
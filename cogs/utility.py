@@ -1,6 +1,11 @@
 import discord
 from discord.ext import commands
-from utils.utils import create_embed, create_error_embed
+from utils.utils import create_embed, create_error_embed, create_success_embed
+from database.database import db
+from utils.metrics import COMMAND_SECONDS, LISTENER_SECONDS, LOOP_LAG, DB_READ_SECONDS, DB_WRITE_SECONDS, DB_WRITE_WAIT, REST_REQUESTS, loop_lag
+
+# userinfo and avatar look up uncached members over the gateway
+INTENTS = ("members",)
 
 class Utility(commands.Cog):
     def __init__(self, bot):
@@ -10,17 +15,77 @@ class Utility(commands.Cog):
     async def on_ready(self):
         print("Utility cog loaded")
     
+    def shard_latency(self, shard_id):
+        shard = self.bot.get_shard(shard_id) if shard_id is not None else None
+        return round((shard.latency if shard else self.bot.latency) * 1000)
+    
     @commands.command(name="ping", help="Check bot latency")
     async def ping(self, ctx):
+        shard_id = ctx.guild.shard_id if ctx.guild else 0
         embed = create_embed(
             "Pong!",
-            f"Bot Latency: {round(self.bot.latency * 1000)}ms"
+            f"Bot Latency: {round(self.bot.latency * 1000)}ms (average)\n"
+            f"This shard ({shard_id}): {self.shard_latency(shard_id)}ms"
+        )
+        
+        guild_counts = {}
+        for guild in self.bot.guilds:
+            guild_counts[guild.shard_id] = guild_counts.get(guild.shard_id, 0) + 1
+        lines = [
+            f"Shard {shard}: {round(latency * 1000)}ms, {guild_counts.get(shard, 0)} guilds"
+            for shard, latency in sorted(self.bot.latencies)
+        ]
+        if len(lines) > 1:
+            shown = "\n".join(lines[:20])
+            if len(lines) > 20:
+                shown += f"\n...and {len(lines) - 20} more"
+            embed.add_field(name=f"Shards in this process ({len(lines)} of {self.bot.shard_count})", value=shown, inline=False)
+        await ctx.send(embed=embed)
+    
+    @staticmethod
+    def timings(histogram):
+        return f"{histogram.count} | p50 {histogram.quantile(0.5) * 1000:.1f}ms | p99 {histogram.quantile(0.99) * 1000:.1f}ms"
+    
+    def slowest(self, family, limit=5):
+        rows = sorted(family.values.items(), key=lambda item: item[1].quantile(0.99), reverse=True)[:limit]
+        return "\n".join(f"`{' '.join(labels)}` {self.timings(histogram)}" for labels, histogram in rows) or "Nothing yet"
+    
+    @commands.command(name="stats", help="Show where the bot spends its time")
+    @commands.has_permissions(administrator=True)
+    async def stats(self, ctx):
+        embed = create_embed("Bot Stats", "Counts and latencies since the bot started")
+        embed.add_field(
+            name="Event Loop Lag",
+            value=f"{self.timings(LOOP_LAG.merged())}\nLast {loop_lag.last * 1000:.1f}ms, worst {loop_lag.worst * 1000:.1f}ms",
+            inline=False
+        )
+        embed.add_field(name="Slowest Commands", value=self.slowest(COMMAND_SECONDS), inline=False)
+        embed.add_field(name="Slowest Listeners", value=self.slowest(LISTENER_SECONDS), inline=False)
+        embed.add_field(
+            name="Database",
+            value=f"Reads: {self.timings(DB_READ_SECONDS.merged())}\n"
+                  f"Writes: {self.timings(DB_WRITE_SECONDS.merged())}\n"
+                  f"Write queue wait p99: {DB_WRITE_WAIT.merged().quantile(0.99) * 1000:.1f}ms",
+            inline=False
+        )
+        
+        routes = {}
+        failed = 0
+        for (method, route, status), count in REST_REQUESTS.values.items():
+            routes[f"{method} {route}"] = routes.get(f"{method} {route}", 0) + count
+            if status != "ok":
+                failed += count
+        busiest = sorted(routes.items(), key=lambda item: item[1], reverse=True)[:5]
+        embed.add_field(
+            name=f"REST Calls ({REST_REQUESTS.total()} total, {failed} failed)",
+            value="\n".join(f"`{route}` {count}" for route, count in busiest) or "Nothing yet",
+            inline=False
         )
         await ctx.send(embed=embed)
     
     @commands.command(name="help", help="Show all commands")
     async def help(self, ctx):
-        embed = create_embed("Help Menu", "Prefix: ~")
+        embed = create_embed("Help Menu", f"Prefix: {ctx.clean_prefix}")
         
         categories = {
             "Moderation": ["kick", "ban", "unmute", "warn", "clear"],
@@ -36,6 +101,24 @@ class Utility(commands.Cog):
         
         await ctx.send(embed=embed)
     
+    @commands.command(name="prefix", help="Show or change the command prefix")
+    async def prefix(self, ctx, new_prefix: str = None):
+        if ctx.guild is None or new_prefix is None:
+            current = db.get_prefix(ctx.guild.id) if ctx.guild else ctx.clean_prefix
+            await ctx.send(embed=create_embed("Prefix", f"The prefix here is `{current}`"))
+            return
+        
+        if not ctx.author.guild_permissions.manage_guild:
+            await ctx.send(embed=create_error_embed("You need Manage Server to change the prefix."))
+            return
+        
+        if len(new_prefix) > 5:
+            await ctx.send(embed=create_error_embed("Prefix must be 5 characters or fewer."))
+            return
+        
+        await db.set_server(ctx.guild.id, prefix=new_prefix)
+        await ctx.send(embed=create_success_embed(f"Prefix changed to `{new_prefix}`"))
+    
     @commands.command(name="userinfo", help="Get user information")
     async def userinfo(self, ctx, member: discord.Member = None):
         member = member or ctx.author
@@ -58,6 +141,7 @@ class Utility(commands.Cog):
         embed.add_field(name="Members", value=guild.member_count, inline=True)
         embed.add_field(name="Channels", value=len(guild.channels), inline=True)
         embed.add_field(name="Roles", value=len(guild.roles), inline=True)
+        embed.add_field(name="Shard", value=f"{guild.shard_id} ({self.shard_latency(guild.shard_id)}ms)", inline=True)
         
         await ctx.send(embed=embed)
     
@@ -8,8 +8,24 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 BOT_PREFIX = "!"
 BOT_NAME = "Ultimate Bot"
 
+# Sharding: leave both unset to let Discord pick the shard count and run them all here.
+# SHARD_IDS must list every shard of SHARD_COUNT. Processes sharing the SQLite file
+# would each keep their own leaderboards, user cache and prefixes, so main.py refuses
+# to run only some of the shards.
+SHARD_COUNT = int(os.getenv('SHARD_COUNT')) if os.getenv('SHARD_COUNT') else None
+SHARD_IDS = os.getenv('SHARD_IDS')
+
+# Gateway: intents are whatever the loaded cogs declare in their INTENTS tuples.
+# MEMBER_CACHE picks which members are kept in memory: "all", "cogs" (only what the
+# cogs declare in MEMBER_CACHE) or "none". Uncached members still arrive with their events.
+MEMBER_CACHE = os.getenv('MEMBER_CACHE', 'cogs')
+CHUNK_GUILDS_AT_STARTUP = os.getenv('CHUNK_GUILDS_AT_STARTUP', '0') == '1'  # download every member list on connect
+
 # Database Configuration
 DATABASE_PATH = "database/bot.db"
+DB_READ_POOL_SIZE = 4
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 300  # seconds before a cached user row is re-read
 
 # API Keys (add your own)
 YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY')
@@ -26,7 +42,61 @@ ENABLE_MODERATION = True
 MUSIC_VOLUME = 0.5
 MAX_QUEUE_SIZE = 100
 MAX_SONG_LENGTH = 600
+EXTRACT_WORKERS = 4  # yt-dlp lookups running at once across all guilds
+EXTRACT_PER_GUILD = 2  # yt-dlp lookups running at once per guild
+EXTRACT_TIMEOUT = 30  # seconds before a lookup is abandoned
+TRACK_CACHE_SIZE = 10000  # resolved tracks kept in the database
+STREAM_URL_TTL = 1800  # seconds a stream URL is trusted when it carries no expiry
+PREFETCH_DEPTH = 2  # upcoming songs kept resolved with ffmpeg already running
+PLAYLIST_CHUNK_SIZE = 25  # playlist entries added to the queue at a time
+
+# Name Resolution Settings
+NAME_CACHE_SIZE = 5000
+NAME_CACHE_TTL = 3600  # seconds a fetched username is trusted
+NAME_FETCH_CONCURRENCY = 10  # one page of a leaderboard resolves in a single round trip
+
+# Leveling Settings
+XP_FLUSH_INTERVAL = 10  # seconds between batched XP writes
+XP_FLUSH_SIZE = 500  # flush early once this many users have pending XP
 
 # Economy Settings
 INITIAL_BALANCE = 100
-DAILY_BONUS = 50
\ No newline at end of file
+DAILY_BONUS = 50
+LEDGER_FLUSH_INTERVAL = 5  # seconds between batched ledger writes
+LEDGER_FLUSH_SIZE = 200  # flush early once this many ledger rows are queued
+LEDGER_COMPACT_INTERVAL = 3600  # seconds between ledger roll-ups
+LEDGER_RETENTION_DAYS = 1  # raw ledger rows older than this are rolled into daily totals
+
+# Moderation Settings
+OVERWRITE_CONCURRENCY = 10  # channel permission edits in flight during muted role setup
+PURGE_MAX_AMOUNT = 10000  # most messages one purge command may delete
+PURGE_SCAN_LIMIT = 20000  # most messages a purge looks through to find matches
+PROGRESS_INTERVAL = 2  # seconds between progress updates on long moderation jobs
+
+# Antinuke Settings
+# action -> (count, seconds): act once one user does count of these within seconds
+ANTINUKE_THRESHOLDS = {
+    "ban": (3, 10),
+    "kick": (3, 10),
+    "channel_create": (5, 10),
+    "channel_delete": (5, 10),
+    "role_create": (5, 10),
+    "role_delete": (5, 10),
+    "webhook_create": (3, 10),
+    "member_prune": (1, 60),
+}
+ANTINUKE_SWEEP_INTERVAL = 60  # seconds between dropping idle counters
+AUDIT_LOG_FETCH_LIMIT = 100  # entries read per audit-log request
+AUDIT_LOG_TTL = 60  # seconds an audit-log entry stays in the index
+AUDIT_LOG_WAIT = 5  # seconds a listener waits for the entry behind its event
+ANTINUKE_SNAPSHOT_INTERVAL = 600  # seconds between structure snapshots of protected guilds
+ANTINUKE_ROLLBACK_WINDOW = 300  # role and channel changes the banned user made this long before a trigger are undone
+ANTINUKE_ROLLBACK_CONCURRENCY = 10  # rollback API calls in flight per guild
+ALERT_DEBOUNCE = 2  # seconds alerts are collected before one summary is posted
+
+# Metrics Settings
+# Prometheus text endpoint at http://METRICS_HOST:METRICS_PORT/metrics; port 0 turns it off.
+# Give each process its own port when shards are split across processes.
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+LOOP_LAG_INTERVAL = 0.5  # seconds between event loop lag samples
\ No newline at end of file
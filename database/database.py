@@ -1,17 +1,234 @@
 import aiosqlite
 import asyncio
-from config import DATABASE_PATH
+import time
+from collections import OrderedDict, namedtuple
+from database.leaderboard import Leaderboard
+from utils.metrics import DB_READ_SECONDS, DB_WRITE_SECONDS, DB_WRITE_WAIT, job_name, query_table
+from config import (
+    BOT_PREFIX, DATABASE_PATH, DB_READ_POOL_SIZE, XP_FLUSH_SIZE, USER_CACHE_SIZE, USER_CACHE_TTL,
+    LEDGER_FLUSH_SIZE, LEDGER_RETENTION_DAYS, TRACK_CACHE_SIZE,
+)
+
+UserRow = namedtuple('UserRow', [
+    'user_id', 'username', 'discriminator', 'balance', 'bank', 'total_xp', 'xp', 'level',
+    'warnings', 'kicks', 'bans', 'daily_claim', 'profile_color', 'net_worth',
+])
+# net_worth is derived, not stored
+USER_COLUMNS = ', '.join(UserRow._fields[:-1]) + ', balance + bank AS net_worth'
+
+ServerRow = namedtuple('ServerRow', [
+    'server_id', 'prefix', 'welcome_channel', 'goodbye_channel', 'log_channel', 'autorole',
+    'muted_role', 'join_message', 'leave_message',
+])
+SERVER_COLUMNS = ', '.join(ServerRow._fields)
+# Settings of a guild that has never changed any
+DEFAULT_SERVER = ServerRow(None, BOT_PREFIX, None, None, None, None, None, None, None)
+
+def xp_level(total_xp):
+    """(xp into the current level, level) that total_xp earns, the way add_xp counts it"""
+    xp, level = total_xp, 1
+    while xp >= level * 100 * level and level < 100:
+        xp -= level * 100 * level
+        level += 1
+    return xp, level
+
+TrackRow = namedtuple('TrackRow', ['track_id', 'title', 'duration', 'thumbnail', 'webpage_url'])
+TRACK_COLUMNS = ', '.join(TrackRow._fields)
+
+# Schema migrations, applied in order on top of create_tables. Each entry
+# bumps PRAGMA user_version by one; never edit an entry once it has shipped.
+MIGRATIONS = [
+    # 1: indexes for warnings lookups and the ledger
+    [
+        'CREATE INDEX IF NOT EXISTS idx_warnings_server_user ON warnings (server_id, user_id, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions (user_id, timestamp)',
+    ],
+    # 2: per-user, per-day, per-type roll-up of old ledger rows
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS transaction_daily (
+                user_id INTEGER,
+                day TEXT,
+                type TEXT,
+                total INTEGER DEFAULT 0,
+                count INTEGER DEFAULT 0,
+                PRIMARY KEY (user_id, day, type)
+            )
+        ''',
+    ],
+    # 3: resolved music metadata, keyed by track id and by normalized query
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS tracks (
+                track_id TEXT PRIMARY KEY,
+                title TEXT,
+                duration INTEGER,
+                thumbnail TEXT,
+                webpage_url TEXT,
+                last_used REAL
+            )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_tracks_last_used ON tracks (last_used)',
+        '''
+            CREATE TABLE IF NOT EXISTS track_queries (
+                query TEXT PRIMARY KEY,
+                track_id TEXT
+            )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_track_queries_track ON track_queries (track_id)',
+    ],
+    # 4: persisted music queues, restored after a restart
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS music_queue (
+                guild_id INTEGER,
+                position INTEGER,
+                track_id TEXT,
+                title TEXT,
+                duration INTEGER,
+                thumbnail TEXT,
+                webpage_url TEXT,
+                requester_id INTEGER,
+                PRIMARY KEY (guild_id, position)
+            )
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS music_players (
+                guild_id INTEGER PRIMARY KEY,
+                voice_channel_id INTEGER,
+                text_channel_id INTEGER
+            )
+        ''',
+    ],
+    # 5: antinuke settings and whitelist
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS guild_security (
+                guild_id INTEGER PRIMARY KEY,
+                antinuke_enabled INTEGER DEFAULT 0
+            )
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS antinuke_whitelist (
+                guild_id INTEGER,
+                user_id INTEGER,
+                PRIMARY KEY (guild_id, user_id)
+            )
+        ''',
+    ],
+    # 6: latest structure snapshot per protected guild, for antinuke rollback
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS guild_snapshots (
+                guild_id INTEGER PRIMARY KEY,
+                taken_at REAL,
+                data BLOB
+            )
+        ''',
+    ],
+    # 7: a user's warnings across every server
+    [
+        'CREATE INDEX IF NOT EXISTS idx_warnings_user ON warnings (user_id, timestamp)',
+    ],
+]
 
 class Database:
     def __init__(self):
         self.db_path = DATABASE_PATH
         self.lock = asyncio.Lock()
+        # self.db is the only connection that writes; it is owned by the writer task
+        self.db = None
+        self.readers = asyncio.Queue()
+        self.write_queue = asyncio.Queue()
+        self.writer_task = None
+        # user_id -> [total_xp, xp, level, xp added since the last flush]
+        self.pending_xp = {}
+        self.flushing_xp = {}
+        self.xp_lock = asyncio.Lock()
+        # In-memory leaderboards kept in step with add_xp/update_user_balance
+        self.xp_board = Leaderboard()
+        self.wealth_board = Leaderboard()
+        # Read-through cache of UserRow objects: user_id -> (row, expires)
+        self.user_cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Bumped on every user write so a read that raced a write is not cached
+        self.cache_epoch = 0
+        # Ledger rows waiting for the next group commit
+        self.pending_ledger = []
+        self.ledger_lock = asyncio.Lock()
+        # server_id -> ServerRow for every row in the servers table, kept in step by set_server
+        self.servers = {}
+        # track_id -> when get_track last served it; written with the next cache_track or on close
+        self.track_touches = {}
+        # Rows in the tracks table, counted at connect and kept in step by cache_track
+        self.track_count = 0
     
     async def connect(self):
-        """Initialize database connection and create tables"""
+        """Initialize database connections and create tables"""
         async with self.lock:
             self.db = await aiosqlite.connect(self.db_path)
+            await self.db.execute('PRAGMA journal_mode=WAL')
+            await self.db.execute('PRAGMA synchronous=NORMAL')
             await self.create_tables()
+            await self.migrate()
+            await self.load_leaderboards()
+            await self.load_servers()
+            cursor = await self.db.execute('SELECT COUNT(*) FROM tracks')
+            self.track_count = (await cursor.fetchone())[0]
+            
+            for _ in range(DB_READ_POOL_SIZE):
+                reader = await aiosqlite.connect(f'file:{self.db_path}?mode=ro', uri=True)
+                self.readers.put_nowait(reader)
+            
+            self.writer_task = asyncio.create_task(self._writer())
+    
+    async def _writer(self):
+        """Run queued mutations one at a time, each in its own transaction"""
+        while True:
+            job, future, queued_at = await self.write_queue.get()
+            if job is None:
+                future.set_result(None)
+                return
+            started = time.perf_counter()
+            DB_WRITE_WAIT.observe(started - queued_at)
+            try:
+                result = await job(self.db)
+                await self.db.commit()
+            except Exception as e:
+                await self.db.rollback()
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+            DB_WRITE_SECONDS.observe(time.perf_counter() - started, job_name(job))
+    
+    async def write(self, job):
+        """Queue job(connection) on the writer task and wait for it to commit"""
+        future = asyncio.get_running_loop().create_future()
+        await self.write_queue.put((job, future, time.perf_counter()))
+        return await future
+    
+    async def fetchone(self, query, params=()):
+        started = time.perf_counter()
+        reader = await self.readers.get()
+        try:
+            cursor = await reader.execute(query, params)
+            return await cursor.fetchone()
+        finally:
+            self.readers.put_nowait(reader)
+            DB_READ_SECONDS.observe(time.perf_counter() - started, query_table(query))
+    
+    async def fetchall(self, query, params=()):
+        started = time.perf_counter()
+        reader = await self.readers.get()
+        try:
+            cursor = await reader.execute(query, params)
+            return await cursor.fetchall()
+        finally:
+            self.readers.put_nowait(reader)
+            DB_READ_SECONDS.observe(time.perf_counter() - started, query_table(query))
     
     async def create_tables(self):
         """Create all necessary database tables"""
@@ -85,108 +302,535 @@ class Database:
         
         await self.db.commit()
     
+    async def migrate(self):
+        """Apply any MIGRATIONS newer than the database's user_version"""
+        cursor = await self.db.execute('PRAGMA user_version')
+        version = (await cursor.fetchone())[0]
+        for number, statements in enumerate(MIGRATIONS[version:], version + 1):
+            try:
+                await self.db.execute('BEGIN')
+                for statement in statements:
+                    await self.db.execute(statement)
+                await self.db.execute(f'PRAGMA user_version = {number}')
+                await self.db.commit()
+            except Exception:
+                await self.db.rollback()
+                raise
+    
+    async def load_leaderboards(self):
+        """Build the in-memory leaderboards from the users table"""
+        cursor = await self.db.execute('SELECT user_id, total_xp, level, balance, bank FROM users')
+        rows = await cursor.fetchall()
+        self.xp_board.load((user_id, total_xp, level) for user_id, total_xp, level, _, _ in rows)
+        self.wealth_board.load((user_id, balance + bank, (balance, bank)) for user_id, _, _, balance, bank in rows)
+    
     async def close(self):
-        """Close database connection"""
+        """Flush buffered writes and close database connections"""
         if self.db:
+            await self.flush_xp()
+            await self.flush_ledger()
+            await self.write(self._write_track_touches)
+            await self.write(None)
+            self.writer_task = None
+            while not self.readers.empty():
+                await self.readers.get_nowait().close()
             await self.db.close()
+            self.db = None
     
     # Server methods
+    async def load_servers(self):
+        """Warm the server settings cache in one query"""
+        cursor = await self.db.execute(f'SELECT {SERVER_COLUMNS} FROM servers')
+        self.servers = {row[0]: ServerRow(*row) for row in await cursor.fetchall()}
+    
+    def server_config(self, server_id):
+        """Cached settings of a guild, defaults included; never touches the database"""
+        return self.servers.get(server_id) or DEFAULT_SERVER._replace(server_id=server_id)
+    
+    def get_prefix(self, server_id):
+        server = self.servers.get(server_id)
+        return server.prefix if server else BOT_PREFIX
+    
     async def get_server(self, server_id):
-        cursor = await self.db.execute('SELECT * FROM servers WHERE server_id = ?', (server_id,))
-        return await cursor.fetchone()
+        return self.servers.get(server_id)
     
     async def set_server(self, server_id, **kwargs):
-        existing = await self.get_server(server_id)
-        if existing:
-            set_clause = ', '.join([f'{k} = ?' for k in kwargs])
-            values = list(kwargs.values()) + [server_id]
-            await self.db.execute(f'UPDATE servers SET {set_clause} WHERE server_id = ?', values)
-        else:
-            columns = 'server_id, ' + ', '.join(kwargs.keys())
-            placeholders = '?, ' + ', '.join(['?' for _ in kwargs])
-            values = [server_id] + list(kwargs.values())
-            await self.db.execute(f'INSERT INTO servers ({columns}) VALUES ({placeholders})', values)
-        await self.db.commit()
+        # Rows created here start from the bot's prefix, not the column default
+        if server_id not in self.servers:
+            kwargs.setdefault('prefix', BOT_PREFIX)
+        
+        async def job(conn):
+            cursor = await conn.execute('SELECT 1 FROM servers WHERE server_id = ?', (server_id,))
+            if await cursor.fetchone():
+                set_clause = ', '.join([f'{k} = ?' for k in kwargs])
+                values = list(kwargs.values()) + [server_id]
+                await conn.execute(f'UPDATE servers SET {set_clause} WHERE server_id = ?', values)
+            else:
+                columns = 'server_id, ' + ', '.join(kwargs.keys())
+                placeholders = '?, ' + ', '.join(['?' for _ in kwargs])
+                values = [server_id] + list(kwargs.values())
+                await conn.execute(f'INSERT INTO servers ({columns}) VALUES ({placeholders})', values)
+        await self.write(job)
+        self.servers[server_id] = self.server_config(server_id)._replace(**kwargs)
+    
+    # User cache
+    def _cached_user(self, user_id):
+        entry = self.user_cache.get(user_id)
+        if entry is not None:
+            user, expires = entry
+            if expires >= time.monotonic():
+                self.user_cache.move_to_end(user_id)
+                self.cache_hits += 1
+                return user
+            del self.user_cache[user_id]
+        self.cache_misses += 1
+        return None
+    
+    def _cache_user(self, user):
+        self.user_cache[user.user_id] = (user, time.monotonic() + USER_CACHE_TTL)
+        self.user_cache.move_to_end(user.user_id)
+        while len(self.user_cache) > USER_CACHE_SIZE:
+            self.user_cache.popitem(last=False)
+    
+    def _patch_user(self, user_id, **fields):
+        """Apply a committed write to the cached row, if there is one"""
+        self.cache_epoch += 1
+        entry = self.user_cache.get(user_id)
+        if entry is not None:
+            user, expires = entry
+            self.user_cache[user_id] = (user._replace(**fields), expires)
+    
+    def cache_stats(self):
+        return {'hits': self.cache_hits, 'misses': self.cache_misses, 'size': len(self.user_cache)}
     
     # User methods
     async def get_user(self, user_id, username=None, discriminator=None):
-        cursor = await self.db.execute(
-            'SELECT * FROM users WHERE user_id = ?',
-            (user_id,)
-        )
-        user = await cursor.fetchone()
+        user = self._cached_user(user_id)
+        if user is None:
+            epoch = self.cache_epoch
+            row = await self.fetchone(f'SELECT {USER_COLUMNS} FROM users WHERE user_id = ?', (user_id,))
+            if row:
+                user = UserRow(*row)
+                if epoch == self.cache_epoch:
+                    self._cache_user(user)
         if not user and username:
-            await self.db.execute(
-                'INSERT INTO users (user_id, username, discriminator) VALUES (?, ?, ?)',
+            await self.write(lambda conn: conn.execute(
+                'INSERT OR IGNORE INTO users (user_id, username, discriminator) VALUES (?, ?, ?)',
                 (user_id, username, discriminator)
-            )
-            await self.db.commit()
-            return await self.get_user(user_id)
+            ))
+            user = await self.get_user(user_id)
+            if user and user_id not in self.xp_board.scores:
+                self.xp_board.update(user_id, user.total_xp, user.level)
+                self.wealth_board.update(user_id, user.net_worth, (user.balance, user.bank))
+            return user
+        if user:
+            # Overlay XP that is still sitting in the write-behind buffer
+            state = self.pending_xp.get(user_id) or self.flushing_xp.get(user_id)
+            if state:
+                total_xp, xp, level, _ = state
+                user = user._replace(total_xp=total_xp, xp=xp, level=level)
         return user
     
+    def get_xp_leaderboard(self, page=0, per_page=10):
+        """Return [(user_id, total_xp, level)] from the in-memory XP board"""
+        return self.xp_board.page(page, per_page)
+    
+    def get_balance_leaderboard(self, page=0, per_page=10):
+        """Return [(user_id, net_worth, (balance, bank))] from the in-memory wealth board"""
+        return self.wealth_board.page(page, per_page)
+    
     async def update_user_balance(self, user_id, amount, transaction_type, description):
-        user = await self.get_user(user_id)
-        if user:
-            new_balance = user[3] + amount
-            await self.db.execute(
-                'UPDATE users SET balance = ? WHERE user_id = ?',
-                (new_balance, user_id)
+        async def job(conn):
+            await conn.execute(
+                'UPDATE users SET balance = balance + ? WHERE user_id = ?',
+                (amount, user_id)
             )
-            await self.db.execute(
-                'INSERT INTO transactions (user_id, amount, type, description) VALUES (?, ?, ?, ?)',
-                (user_id, amount, transaction_type, description)
+            cursor = await conn.execute('SELECT balance, bank FROM users WHERE user_id = ?', (user_id,))
+            return await cursor.fetchone()
+        result = await self.write(job)
+        if result is None:
+            return None
+        new_balance, bank = result
+        self._balance_changed(user_id, new_balance, bank)
+        await self.log_transaction(user_id, amount, transaction_type, description)
+        return new_balance
+    
+    def _balance_changed(self, user_id, balance, bank):
+        self._patch_user(user_id, balance=balance, net_worth=balance + bank)
+        self.wealth_board.update(user_id, balance + bank, (balance, bank))
+    
+    async def transfer(self, sender_id, receiver_id, amount, sender_description, receiver_description, transaction_type="transfer"):
+        """Move amount between wallets in one transaction.
+        
+        Returns (sender_balance, receiver_balance), or None without changing
+        anything if either user is missing or the sender cannot cover amount.
+        """
+        async def job(conn):
+            cursor = await conn.execute('SELECT 1 FROM users WHERE user_id = ?', (receiver_id,))
+            if not await cursor.fetchone():
+                return None
+            cursor = await conn.execute(
+                'UPDATE users SET balance = balance - ? WHERE user_id = ? AND balance >= ?',
+                (amount, sender_id, amount)
             )
-            await self.db.commit()
-            return new_balance
-        return None
+            if cursor.rowcount == 0:
+                return None
+            await conn.execute('UPDATE users SET balance = balance + ? WHERE user_id = ?', (amount, receiver_id))
+            cursor = await conn.execute(
+                'SELECT user_id, balance, bank FROM users WHERE user_id IN (?, ?)',
+                (sender_id, receiver_id)
+            )
+            return await cursor.fetchall()
+        rows = await self.write(job)
+        if rows is None:
+            return None
+        balances = {}
+        for user_id, balance, bank in rows:
+            self._balance_changed(user_id, balance, bank)
+            balances[user_id] = balance
+        await self.log_transaction(sender_id, -amount, transaction_type, sender_description)
+        await self.log_transaction(receiver_id, amount, transaction_type, receiver_description)
+        return balances[sender_id], balances[receiver_id]
+    
+    async def apply_bet(self, user_id, stake, payout, transaction_type, description):
+        """Take stake from the wallet and pay out payout in one transaction.
+        
+        The ledger gets a single row for the net result. Returns the new
+        balance, or None without changing anything if the user cannot cover
+        stake.
+        """
+        async def job(conn):
+            cursor = await conn.execute(
+                'UPDATE users SET balance = balance - ? + ? WHERE user_id = ? AND balance >= ?',
+                (stake, payout, user_id, stake)
+            )
+            if cursor.rowcount == 0:
+                return None
+            cursor = await conn.execute('SELECT balance, bank FROM users WHERE user_id = ?', (user_id,))
+            return await cursor.fetchone()
+        result = await self.write(job)
+        if result is None:
+            return None
+        new_balance, bank = result
+        self._balance_changed(user_id, new_balance, bank)
+        await self.log_transaction(user_id, payout - stake, transaction_type, description)
+        return new_balance
+    
+    # Ledger methods
+    async def log_transaction(self, user_id, amount, transaction_type, description):
+        """Queue a ledger row; rows are written in batches by flush_ledger"""
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        self.pending_ledger.append((user_id, amount, transaction_type, description, timestamp))
+        if len(self.pending_ledger) >= LEDGER_FLUSH_SIZE:
+            await self.flush_ledger()
+    
+    async def flush_ledger(self):
+        """Write all queued ledger rows with one executemany and one commit"""
+        async with self.ledger_lock:
+            if not self.pending_ledger:
+                return
+            rows, self.pending_ledger = self.pending_ledger, []
+            try:
+                await self.write(lambda conn: conn.executemany(
+                    'INSERT INTO transactions (user_id, amount, type, description, timestamp) VALUES (?, ?, ?, ?, ?)',
+                    rows
+                ))
+            except Exception:
+                self.pending_ledger[:0] = rows
+                raise
+    
+    async def compact_ledger(self, retention_days=LEDGER_RETENTION_DAYS):
+        """Roll ledger rows older than retention_days into transaction_daily"""
+        await self.flush_ledger()
+        cutoff = time.strftime('%Y-%m-%d', time.gmtime(time.time() - retention_days * 86400))
+        async def job(conn):
+            await conn.execute('''
+                INSERT INTO transaction_daily (user_id, day, type, total, count)
+                SELECT user_id, date(timestamp), type, SUM(amount), COUNT(*)
+                FROM transactions WHERE timestamp < ?
+                GROUP BY user_id, date(timestamp), type
+                ON CONFLICT (user_id, day, type) DO UPDATE SET
+                    total = total + excluded.total,
+                    count = count + excluded.count
+            ''', (cutoff,))
+            cursor = await conn.execute('DELETE FROM transactions WHERE timestamp < ?', (cutoff,))
+            return cursor.rowcount
+        return await self.write(job)
+    
+    async def get_ledger_total(self, user_id, types=None, days=7):
+        """Net amount a user gained or lost over the last `days` days, today included.
+        
+        Rolled-up days come from transaction_daily, recent days from the raw
+        ledger, plus anything still waiting to be flushed.
+        """
+        since = time.strftime('%Y-%m-%d', time.gmtime(time.time() - (days - 1) * 86400))
+        type_clause = ''
+        params = [user_id, since]
+        if types:
+            type_clause = f" AND type IN ({', '.join('?' for _ in types)})"
+            params += list(types)
+        rolled = await self.fetchone(
+            f'SELECT COALESCE(SUM(total), 0) FROM transaction_daily WHERE user_id = ? AND day >= ?{type_clause}',
+            params
+        )
+        recent = await self.fetchone(
+            f'SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE user_id = ? AND timestamp >= ?{type_clause}',
+            params
+        )
+        pending = sum(
+            amount for row_user, amount, row_type, _, timestamp in self.pending_ledger
+            if row_user == user_id and timestamp >= since and (not types or row_type in types)
+        )
+        return rolled[0] + recent[0] + pending
     
     async def add_xp(self, user_id, amount):
-        user = await self.get_user(user_id)
-        if user:
-            new_xp = user[6] + amount
-            new_total_xp = user[5] + amount
-            required_xp = user[7] * 100 * user[7]
-            level_up = False
-            new_level = user[7]
+        """Add XP in memory; the row is written later by flush_xp"""
+        state = self.pending_xp.get(user_id)
+        if state is None:
+            base = self.flushing_xp.get(user_id)
+            if base is None:
+                user = await self.get_user(user_id)
+                if not user:
+                    return False, 1, 0
+                base = (user.total_xp, user.xp, user.level)
+            # Another add_xp may have started the entry while get_user was waiting
+            state = self.pending_xp.get(user_id)
+            if state is None:
+                state = self.pending_xp[user_id] = [*base[:3], 0]
+        
+        new_total_xp, new_xp, new_level, added = state
+        new_xp += amount
+        new_total_xp += amount
+        required_xp = new_level * 100 * new_level
+        level_up = False
+        
+        while new_xp >= required_xp and new_level < 100:
+            new_xp -= required_xp
+            new_level += 1
+            level_up = True
+            required_xp = new_level * 100 * new_level
+        
+        state[:] = [new_total_xp, new_xp, new_level, added + amount]
+        self.xp_board.update(user_id, new_total_xp, new_level)
+        
+        if len(self.pending_xp) >= XP_FLUSH_SIZE:
+            await self.flush_xp()
+        return level_up, new_level, new_xp
+    
+    async def flush_xp(self):
+        """Write all buffered XP to the users table in one transaction"""
+        async with self.xp_lock:
+            if not self.pending_xp:
+                return
+            self.flushing_xp, self.pending_xp = self.pending_xp, {}
+            added = [(state[3], user_id) for user_id, state in self.flushing_xp.items()]
             
-            while new_xp >= required_xp and new_level < 100:
-                new_xp -= required_xp
-                new_level += 1
-                level_up = True
-                required_xp = new_level * 100 * new_level
+            # Add to whatever the row holds now and derive xp and level from the new total,
+            # so XP another process wrote to the same file is kept rather than overwritten
+            async def job(conn):
+                await conn.executemany('UPDATE users SET total_xp = total_xp + ? WHERE user_id = ?', added)
+                totals = {}
+                user_ids = [user_id for _, user_id in added]
+                for start in range(0, len(user_ids), XP_FLUSH_SIZE):
+                    chunk = user_ids[start:start + XP_FLUSH_SIZE]
+                    cursor = await conn.execute(
+                        f'SELECT user_id, total_xp FROM users WHERE user_id IN ({", ".join("?" * len(chunk))})',
+                        chunk
+                    )
+                    totals.update(await cursor.fetchall())
+                await conn.executemany(
+                    'UPDATE users SET xp = ?, level = ? WHERE user_id = ?',
+                    [(*xp_level(total_xp), user_id) for user_id, total_xp in totals.items()]
+                )
+                return totals
             
-            await self.db.execute(
-                'UPDATE users SET total_xp = ?, xp = ?, level = ? WHERE user_id = ?',
-                (new_total_xp, new_xp, new_level, user_id)
+            try:
+                totals = await self.write(job)
+                for user_id, total_xp in totals.items():
+                    xp, level = xp_level(total_xp)
+                    self._patch_user(user_id, total_xp=total_xp, xp=xp, level=level)
+                    state = self.pending_xp.get(user_id)
+                    if state:
+                        # XP added during the flush goes on top of the stored total
+                        total_xp += state[3]
+                        xp, level = xp_level(total_xp)
+                        state[:3] = [total_xp, xp, level]
+                    self.xp_board.update(user_id, total_xp, level)
+            except Exception:
+                # Put the rows back so the next flush retries them
+                for user_id, state in self.flushing_xp.items():
+                    pending = self.pending_xp.get(user_id)
+                    if pending:
+                        pending[3] += state[3]
+                    else:
+                        self.pending_xp[user_id] = state
+                raise
+            finally:
+                self.flushing_xp = {}
+    
+    # Music track cache
+    async def get_track(self, key):
+        """Look a track up by track id or by normalized query, marking it recently used"""
+        row = await self.fetchone(f'SELECT {TRACK_COLUMNS} FROM tracks WHERE track_id = ?', (key,))
+        if not row:
+            row = await self.fetchone(
+                f'SELECT {TRACK_COLUMNS} FROM tracks WHERE track_id = (SELECT track_id FROM track_queries WHERE query = ?)',
+                (key,)
             )
-            await self.db.commit()
-            return level_up, new_level, new_xp
-        return False, 1, 0
+        if not row:
+            return None
+        track = TrackRow(*row)
+        self.track_touches[track.track_id] = time.time()
+        return track
     
-    # Warning methods
-    async def add_warning(self, user_id, moderator_id, reason, server_id):
-        await self.db.execute(
-            'INSERT INTO warnings (user_id, moderator_id, reason, server_id) VALUES (?, ?, ?, ?)',
-            (user_id, moderator_id, reason, server_id)
+    async def get_track_titles(self):
+        return await self.fetchall('SELECT track_id, title FROM tracks')
+    
+    async def cache_track(self, track, query=None):
+        """Store a TrackRow (and the query that found it), evicting the least recently used.
+        
+        Returns the ids of evicted tracks."""
+        async def job(conn):
+            # Eviction goes by last_used, so recent hits must be on disk first
+            await self._write_track_touches(conn)
+            cursor = await conn.execute('SELECT 1 FROM tracks WHERE track_id = ?', (track.track_id,))
+            added = await cursor.fetchone() is None
+            await conn.execute(
+                f'INSERT OR REPLACE INTO tracks ({TRACK_COLUMNS}, last_used) VALUES (?, ?, ?, ?, ?, ?)',
+                (*track, time.time())
+            )
+            if query:
+                await conn.execute(
+                    'INSERT OR REPLACE INTO track_queries (query, track_id) VALUES (?, ?)',
+                    (query, track.track_id)
+                )
+            count = self.track_count + added
+            excess = count - TRACK_CACHE_SIZE
+            if excess <= 0:
+                self.track_count = count
+                return []
+            cursor = await conn.execute('SELECT track_id FROM tracks ORDER BY last_used LIMIT ?', (excess,))
+            evicted = [(row[0],) for row in await cursor.fetchall()]
+            await conn.executemany('DELETE FROM tracks WHERE track_id = ?', evicted)
+            await conn.executemany('DELETE FROM track_queries WHERE track_id = ?', evicted)
+            self.track_count = count - len(evicted)
+            return [track_id for track_id, in evicted]
+        return await self.write(job)
+    
+    async def _write_track_touches(self, conn):
+        touches, self.track_touches = self.track_touches, {}
+        await conn.executemany(
+            'UPDATE tracks SET last_used = ? WHERE track_id = ?',
+            [(used, track_id) for track_id, used in touches.items()]
         )
-        await self.db.execute(
-            'UPDATE users SET warnings = warnings + 1 WHERE user_id = ?',
-            (user_id,)
+    
+    # Music queue persistence
+    async def add_music_tracks(self, guild_id, tracks):
+        await self.write(lambda conn: conn.executemany(
+            '''INSERT OR REPLACE INTO music_queue
+               (guild_id, position, track_id, title, duration, thumbnail, webpage_url, requester_id)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            [(guild_id, t.position, t.track_id, t.title, t.duration, t.thumbnail, t.webpage_url, t.requester_id)
+             for t in tracks]
+        ))
+    
+    async def trim_music_queue(self, guild_id, position):
+        """Forget every queue row before position (songs that already finished)"""
+        await self.write(lambda conn: conn.execute(
+            'DELETE FROM music_queue WHERE guild_id = ? AND position < ?', (guild_id, position)
+        ))
+    
+    async def clear_music_state(self, guild_id):
+        """Forget a guild's saved queue and player so a restart does not bring them back"""
+        async def job(conn):
+            await conn.execute('DELETE FROM music_queue WHERE guild_id = ?', (guild_id,))
+            await conn.execute('DELETE FROM music_players WHERE guild_id = ?', (guild_id,))
+        await self.write(job)
+    
+    async def set_music_player(self, guild_id, voice_channel_id, text_channel_id):
+        await self.write(lambda conn: conn.execute(
+            'INSERT OR REPLACE INTO music_players (guild_id, voice_channel_id, text_channel_id) VALUES (?, ?, ?)',
+            (guild_id, voice_channel_id, text_channel_id)
+        ))
+    
+    async def load_music_state(self):
+        """Return ({guild_id: (voice_channel_id, text_channel_id)}, {guild_id: [queue rows]})"""
+        players = {
+            guild_id: (voice_channel_id, text_channel_id)
+            for guild_id, voice_channel_id, text_channel_id in await self.fetchall('SELECT * FROM music_players')
+        }
+        queues = {}
+        rows = await self.fetchall(
+            '''SELECT guild_id, position, track_id, title, duration, thumbnail, webpage_url, requester_id
+               FROM music_queue ORDER BY guild_id, position'''
         )
-        await self.db.commit()
+        for row in rows:
+            queues.setdefault(row[0], []).append(row[1:])
+        return players, queues
+    
+    # Warning methods
+    async def add_warning(self, user_id, moderator_id, reason, server_id):
+        async def job(conn):
+            await conn.execute(
+                'INSERT INTO warnings (user_id, moderator_id, reason, server_id) VALUES (?, ?, ?, ?)',
+                (user_id, moderator_id, reason, server_id)
+            )
+            await conn.execute(
+                'UPDATE users SET warnings = warnings + 1 WHERE user_id = ?',
+                (user_id,)
+            )
+        await self.write(job)
+        self.cache_epoch += 1
+        self.user_cache.pop(user_id, None)
+    
+    # Antinuke settings
+    async def load_security(self):
+        """Return (set of guild ids with antinuke on, {guild_id: set of whitelisted user ids})"""
+        enabled = {
+            guild_id for (guild_id,) in
+            await self.fetchall('SELECT guild_id FROM guild_security WHERE antinuke_enabled = 1')
+        }
+        whitelist = {}
+        for guild_id, user_id in await self.fetchall('SELECT guild_id, user_id FROM antinuke_whitelist'):
+            whitelist.setdefault(guild_id, set()).add(user_id)
+        return enabled, whitelist
+    
+    async def set_antinuke(self, guild_id, enabled):
+        await self.write(lambda conn: conn.execute(
+            'INSERT OR REPLACE INTO guild_security (guild_id, antinuke_enabled) VALUES (?, ?)',
+            (guild_id, int(enabled))
+        ))
+    
+    async def add_whitelist(self, guild_id, user_id):
+        await self.write(lambda conn: conn.execute(
+            'INSERT OR IGNORE INTO antinuke_whitelist (guild_id, user_id) VALUES (?, ?)', (guild_id, user_id)
+        ))
+    
+    async def remove_whitelist(self, guild_id, user_id):
+        await self.write(lambda conn: conn.execute(
+            'DELETE FROM antinuke_whitelist WHERE guild_id = ? AND user_id = ?', (guild_id, user_id)
+        ))
+    
+    async def save_snapshot(self, guild_id, data):
+        await self.write(lambda conn: conn.execute(
+            'INSERT OR REPLACE INTO guild_snapshots (guild_id, taken_at, data) VALUES (?, ?, ?)',
+            (guild_id, time.time(), data)
+        ))
+    
+    async def get_snapshot(self, guild_id):
+        """Return (taken_at, packed data) of a guild's latest snapshot, or None"""
+        return await self.fetchone('SELECT taken_at, data FROM guild_snapshots WHERE guild_id = ?', (guild_id,))
     
     async def get_warnings(self, user_id, server_id=None):
         if server_id:
-            cursor = await self.db.execute(
+            return await self.fetchall(
                 'SELECT * FROM warnings WHERE user_id = ? AND server_id = ? ORDER BY timestamp DESC',
                 (user_id, server_id)
             )
-        else:
-            cursor = await self.db.execute(
-                'SELECT * FROM warnings WHERE user_id = ? ORDER BY timestamp DESC',
-                (user_id,)
-            )
-        return await cursor.fetchall()
+        return await self.fetchall(
+            'SELECT * FROM warnings WHERE user_id = ? ORDER BY timestamp DESC',
+            (user_id,)
+        )
 
 # Global database instance
 db = Database()
\ No newline at end of file
@@ -0,0 +1,53 @@
+from bisect import bisect_left, insort
+
+class Leaderboard:
+    """Users ordered by score, kept sorted in memory"""
+
+    def __init__(self):
+        # (-score, user_id) pairs, so top K, pages and ranks are bisects and slices; ties go by user id
+        self.order = []
+        self.scores = {}
+        self.data = {}
+
+    def __len__(self):
+        return len(self.order)
+
+    def load(self, entries):
+        """Replace the board with (user_id, score, data) entries"""
+        self.scores = {}
+        self.data = {}
+        for user_id, score, data in entries:
+            self.scores[user_id] = score
+            self.data[user_id] = data
+        self.order = sorted((-score, user_id) for user_id, score in self.scores.items())
+
+    def update(self, user_id, score, data=None):
+        old = self.scores.get(user_id)
+        self.data[user_id] = data
+        if old == score:
+            return
+        if old is not None:
+            del self.order[bisect_left(self.order, (-old, user_id))]
+        self.scores[user_id] = score
+        insort(self.order, (-score, user_id))
+
+    def remove(self, user_id):
+        old = self.scores.pop(user_id, None)
+        self.data.pop(user_id, None)
+        if old is not None:
+            del self.order[bisect_left(self.order, (-old, user_id))]
+
+    def page(self, page=0, per_page=10):
+        """Return [(user_id, score, data)] for a zero-based page"""
+        start = page * per_page
+        return [(user_id, -score, self.data[user_id]) for score, user_id in self.order[start:start + per_page]]
+
+    def top(self, k=10):
+        return self.page(0, k)
+
+    def rank(self, user_id):
+        """Return the user's 1-based rank, or None if they are not on the board"""
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return bisect_left(self.order, (-score, user_id)) + 1
@@ -5,6 +5,11 @@ from datetime import datetime
 import discord
 from discord.ext import commands
 from colorama import Fore, Style, init
+from database.database import db
+from config import BOT_PREFIX, SHARD_COUNT, SHARD_IDS, METRICS_HOST, METRICS_PORT
+from utils.utils import parse_shard_ids
+from utils.gateway import gateway_settings
+from utils.metrics import MetricsServer, instrument_bot, loop_lag
 
 init(autoreset=True)
 logging.basicConfig(level=logging.INFO)
@@ -17,23 +22,60 @@ if not BOT_TOKEN:
     logger.error("BOT_TOKEN not found!")
     exit(1)
 
-intents = discord.Intents.default()
-intents.message_content = True
-intents.members = True
-intents.presences = True
+COGS = ['cogs.moderation', 'cogs.utility', 'cogs.economy', 'cogs.games', 'cogs.level', 'cogs.music', 'cogs.antinuke']
 
-bot = commands.Bot(command_prefix='!', intents=intents, help_command=None)
+# Intents and member cache follow what the cogs declare; see MEMBER_CACHE in config.py
+try:
+    gateway = gateway_settings(COGS)
+except ValueError as e:
+    logger.error(e)
+    exit(1)
+
+def get_prefix(bot, message):
+    # Served from the in-memory server cache: no database call per message
+    prefix = db.get_prefix(message.guild.id) if message.guild else BOT_PREFIX
+    return commands.when_mentioned_or(prefix)(bot, message)
+
+try:
+    shard_ids = parse_shard_ids(SHARD_IDS)
+except ValueError as e:
+    logger.error(e)
+    exit(1)
+if shard_ids is not None and SHARD_COUNT is None:
+    logger.error("SHARD_IDS needs SHARD_COUNT to be set as well")
+    exit(1)
+if shard_ids is not None and shard_ids[-1] >= SHARD_COUNT:
+    logger.error(f"SHARD_IDS goes past SHARD_COUNT ({SHARD_COUNT})")
+    exit(1)
+if shard_ids is not None and len(shard_ids) < SHARD_COUNT:
+    # In-memory caches are per process, so another process would serve stale data
+    logger.error(f"SHARD_IDS must cover all {SHARD_COUNT} shards; this process can't share the database")
+    exit(1)
+
+bot = commands.AutoShardedBot(
+    command_prefix=get_prefix,
+    help_command=None,
+    shard_count=SHARD_COUNT,
+    shard_ids=shard_ids,
+    **gateway,
+)
+instrument_bot(bot)
 
 @bot.event
 async def on_ready():
     logger.info(f'{Fore.GREEN}Bot is ready!{Style.RESET_ALL}')
     logger.info(f'Bot: {bot.user}')
+    logger.info(f'Shards: {sorted(bot.shards)} of {bot.shard_count}')
     logger.info(f'Guilds: {len(bot.guilds)}')
+    logger.info(f'Intents: {", ".join(name for name, enabled in bot.intents if enabled)}')
+
+@bot.event
+async def on_shard_ready(shard_id):
+    logger.info(f'Shard {shard_id} is ready')
 
 # Load cogs
 async def load_cogs():
-    cogs = ['cogs.moderation', 'cogs.utility', 'cogs.economy', 'cogs.games', 'cogs.level', 'cogs.music', 'cogs.antinuke']
-    for cog in cogs:
+    for cog in COGS:
         try:
             await bot.load_extension(cog)
             logger.info(f'Loaded {cog}')
@@ -41,10 +83,26 @@ async def load_cogs():
             logger.error(f'Failed to load {cog}: {e}')
 
 async def main():
+    await db.connect()
     await load_cogs()
+    loop_lag.start()
+    metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT)
+    if METRICS_PORT:
+        try:
+            await metrics_server.start()
+            logger.info(f'Metrics at http://{METRICS_HOST}:{METRICS_PORT}/metrics')
+        except OSError as e:
+            logger.error(f'Metrics endpoint not started: {e}')
     try:
         await bot.start(BOT_TOKEN)
     except Exception as e:
         logger.error(f'Error: {e}')
+    finally:
+        loop_lag.stop()
+        await metrics_server.stop()
+        # Make sure write-behind buffers reach disk before exiting
+        if not bot.is_closed():
+            await bot.close()
+        await db.close()
 
 asyncio.run(main())
\ No newline at end of file
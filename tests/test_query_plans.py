@@ -0,0 +1,63 @@
+import asyncio
+import aiosqlite
+from config import DB_READ_POOL_SIZE
+from database.database import Database
+
+# Tables that grow with the user base; a full scan of one on a hot path is a bug
+INDEXED_TABLES = ('users', 'warnings', 'transactions', 'transaction_daily', 'tracks')
+
+async def run_hot_paths(path):
+    """Run the hot paths on a fresh database at path and return every statement they sent"""
+    database = Database()
+    database.db_path = path
+    await database.connect()
+    statements = []
+    readers = [await database.readers.get() for _ in range(DB_READ_POOL_SIZE)]
+    for conn in [database.db] + readers:
+        await conn.set_trace_callback(statements.append)
+    for reader in readers:
+        database.readers.put_nowait(reader)
+
+    await database.get_user(1, 'a', '0')
+    await database.get_user(2, 'b', '0')
+    database.user_cache.clear()
+    await database.get_user(1)
+    await database.update_user_balance(1, 50, 'daily', 'Daily bonus')
+    await database.transfer(1, 2, 10, 'Paid b', 'Paid by a')
+    await database.apply_bet(1, 5, 10, 'gamble', 'Coinflip')
+    await database.add_xp(1, 20)
+    await database.flush_xp()
+    await database.flush_ledger()
+    await database.get_ledger_total(1)
+    await database.get_ledger_total(1, types=['gamble'])
+    await database.add_warning(2, 1, 'spam', 10)
+    await database.get_warnings(2, 10)
+    await database.get_warnings(2)
+    await database.get_track('youtube:abc')
+    await database.close()
+    return list(dict.fromkeys(statements))
+
+async def full_scans(path, statements):
+    """Return (plan detail, statement) for every full scan of an INDEXED_TABLES table"""
+    scans = []
+    async with aiosqlite.connect(path) as conn:
+        for statement in statements:
+            if not statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            cursor = await conn.execute(f'EXPLAIN QUERY PLAN {statement}')
+            for row in await cursor.fetchall():
+                if any(row[-1].startswith(f'SCAN {table}') for table in INDEXED_TABLES):
+                    scans.append((row[-1], ' '.join(statement.split())))
+    return scans
+
+def test_hot_paths_use_indexes(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    statements = asyncio.run(run_hot_paths(path))
+    assert statements
+    assert asyncio.run(full_scans(path, statements)) == []
+
+def test_full_scan_is_reported(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    asyncio.run(run_hot_paths(path))
+    scans = asyncio.run(full_scans(path, ["SELECT * FROM users WHERE username = 'a'"]))
+    assert [detail for detail, _ in scans] == ['SCAN users']
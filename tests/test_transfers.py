@@ -0,0 +1,56 @@
+import asyncio
+import random
+from database.database import Database
+
+USERS = 50
+TRANSFERS = 2000
+BETS = 500
+
+async def run_concurrent_load(path):
+    """Fire transfers and bets at the same wallets at once; return the open database and starting balances"""
+    database = Database()
+    database.db_path = path
+    await database.connect()
+    rng = random.Random(7)
+    ids = list(range(1, USERS + 1))
+    for user_id in ids:
+        await database.get_user(user_id, f'user{user_id}', '0')
+    start = {user_id: (await database.get_user(user_id)).balance for user_id in ids}
+
+    async def pay():
+        sender, receiver = rng.sample(ids, 2)
+        await database.transfer(sender, receiver, rng.randint(1, 80), 'stress', 'stress')
+
+    async def bet():
+        stake = rng.randint(1, 60)
+        await database.apply_bet(rng.choice(ids), stake, rng.choice((0, stake * 2)), 'gamble', 'stress')
+
+    calls = [pay() for _ in range(TRANSFERS)] + [bet() for _ in range(BETS)]
+    rng.shuffle(calls)
+    await asyncio.gather(*calls)
+    await database.flush_ledger()
+    return database, start
+
+async def check_books(path):
+    database, start = await run_concurrent_load(path)
+    try:
+        balances = dict(await database.fetchall('SELECT user_id, balance FROM users'))
+        ledger = dict(await database.fetchall('SELECT user_id, SUM(amount) FROM transactions GROUP BY user_id'))
+        bet_net = (await database.fetchone("SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE type = 'gamble'"))[0]
+        cached = {user_id: database._cached_user(user_id) for user_id in balances}
+        board = dict(database.wealth_board.scores)
+    finally:
+        await database.close()
+    return start, balances, ledger, bet_net, cached, board
+
+def test_concurrent_transfers_keep_the_books(tmp_path):
+    start, balances, ledger, bet_net, cached, board = asyncio.run(check_books(str(tmp_path / 'bot.db')))
+
+    # Transfers only move money; bets are the only thing that creates or destroys it
+    assert sum(balances.values()) == sum(start.values()) + bet_net
+    assert min(balances.values()) >= 0
+    for user_id, balance in balances.items():
+        assert balance == start[user_id] + ledger.get(user_id, 0), user_id
+        if cached[user_id]:
+            assert cached[user_id].balance == balance, user_id
+        assert board[user_id] == balance, user_id
@@ -0,0 +1,78 @@
+import asyncio
+import discord
+from database.database import db
+from utils.utils import create_embed
+from config import ALERT_DEBOUNCE
+
+# Discord's limit on an embed description
+MAX_DESCRIPTION = 4096
+
+class AlertSender:
+    """Posts alerts to each guild's log channel, batching bursts into one embed"""
+
+    def __init__(self, bot, title, debounce=ALERT_DEBOUNCE):
+        self.bot = bot
+        self.title = title
+        self.debounce = debounce
+        # guild_id -> channel id, or None when the guild has nowhere to post;
+        # servers.log_channel if writable, else the first writable text channel, until invalidate()
+        self.channels = {}
+        # guild_id -> alerts held for debounce seconds after the first, then sent as one embed
+        self.pending = {}
+        self.flushes = {}
+
+    def invalidate(self, guild_id):
+        self.channels.pop(guild_id, None)
+
+    async def channel(self, guild):
+        if guild.id not in self.channels:
+            self.channels[guild.id] = await self._resolve(guild)
+        channel_id = self.channels[guild.id]
+        return guild.get_channel(channel_id) if channel_id else None
+
+    async def _resolve(self, guild):
+        server = await db.get_server(guild.id)
+        if server and server.log_channel:
+            channel = guild.get_channel(server.log_channel)
+            if channel and channel.permissions_for(guild.me).send_messages:
+                return channel.id
+        for channel in guild.text_channels:
+            if channel.permissions_for(guild.me).send_messages:
+                return channel.id
+        return None
+
+    def send(self, guild, line):
+        """Queue one alert line; it goes out with any others raised within the debounce window"""
+        self.pending.setdefault(guild.id, []).append(line)
+        if guild.id not in self.flushes:
+            self.flushes[guild.id] = asyncio.create_task(self._flush_later(guild))
+
+    async def _flush_later(self, guild):
+        try:
+            await asyncio.sleep(self.debounce)
+        finally:
+            self.flushes.pop(guild.id, None)
+        lines = self.pending.pop(guild.id, [])
+        if lines:
+            await self.flush(guild, lines)
+
+    async def flush(self, guild, lines):
+        channel = await self.channel(guild)
+        if channel is None:
+            return
+        description = ""
+        for i, line in enumerate(lines):
+            more = f"\n...and {len(lines) - i} more"
+            if len(description) + len(line) + 1 + len(more) > MAX_DESCRIPTION:
+                description += more
+                break
+            description += f"{line}\n"
+        try:
+            await channel.send(embed=create_embed(self.title, description.strip()))
+        except discord.HTTPException:
+            # Lost access since it was resolved; pick another channel next time
+            self.invalidate(guild.id)
+
+    def close(self):
+        for task in self.flushes.values():
+            task.cancel()
@@ -0,0 +1,139 @@
+import asyncio
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
+import discord
+from config import AUDIT_LOG_FETCH_LIMIT, AUDIT_LOG_TTL, AUDIT_LOG_WAIT
+
+# Pause between polls while a listener is still waiting for its entry
+POLL_DELAY = 0.25
+# Time the gateway gets to push an entry before the first poll
+GATEWAY_GRACE = 0.1
+
+class AuditLogIndex:
+    """Maps (action, target id) to the user who did it, per guild, from batched audit-log reads"""
+
+    def __init__(self, fetch_limit=AUDIT_LOG_FETCH_LIMIT, ttl=AUDIT_LOG_TTL, wait=AUDIT_LOG_WAIT):
+        self.fetch_limit = fetch_limit
+        self.ttl = ttl
+        self.wait = wait
+        # guild_id -> OrderedDict[(action, target_id)] = (entry_id, user, added_at)
+        self.entries = {}
+        # guild_id -> newest entry id seen, used as the lower bound of the next poll
+        self.newest = {}
+        # guild_id -> {(action, target_id): [futures]}
+        self.waiters = {}
+        # guild_id -> the one poll in flight; listeners that miss the index share it
+        self.polls = {}
+        self.fetches = 0
+        self.lookups = 0
+
+    def add(self, entry):
+        """Index one audit-log entry; duplicates and older entries for a key are ignored"""
+        guild_id = entry.guild.id
+        target_id = getattr(entry.target, "id", None)
+        key = (entry.action, target_id)
+        entries = self.entries.setdefault(guild_id, OrderedDict())
+        known = entries.get(key)
+        if known and known[0] >= entry.id:
+            return
+        user = entry.user or discord.Object(entry.user_id)
+        entries[key] = (entry.id, user, time.monotonic())
+        entries.move_to_end(key)
+        if entry.id > self.newest.get(guild_id, 0):
+            self.newest[guild_id] = entry.id
+
+        for future in self.waiters.get(guild_id, {}).pop(key, ()):
+            if not future.done():
+                future.set_result(user)
+        self._expire(entries)
+
+    def _expire(self, entries):
+        cutoff = time.monotonic() - self.ttl
+        while entries:
+            key, (_, _, added_at) = next(iter(entries.items()))
+            if added_at > cutoff:
+                break
+            entries.popitem(last=False)
+
+    async def actor(self, guild, action, target_id):
+        """Return the user behind action on target_id, or None if no entry turns up in time"""
+        self.lookups += 1
+        known = self.entries.get(guild.id, {}).get((action, target_id))
+        if known:
+            return known[1]
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(guild.id, {}).setdefault((action, target_id), []).append(future)
+        if guild.id not in self.polls:
+            self.polls[guild.id] = asyncio.create_task(self._poll(guild))
+        try:
+            return await asyncio.wait_for(future, self.wait)
+        except asyncio.TimeoutError:
+            waiting = self.waiters.get(guild.id, {}).get((action, target_id), [])
+            if future in waiting:
+                waiting.remove(future)
+            return None
+
+    async def _poll(self, guild):
+        try:
+            deadline = time.monotonic() + self.wait
+            await asyncio.sleep(GATEWAY_GRACE)
+            self._drop_resolved(guild.id)
+            while self.waiters.get(guild.id) and time.monotonic() < deadline:
+                newest = self.newest.get(guild.id)
+                # Paging forward from a cursor older than the TTL could run out the clock before
+                # reaching the live entry; the latest page is where that entry is
+                if newest and discord.utils.snowflake_time(newest).timestamp() < time.time() - self.ttl:
+                    newest = None
+                after = discord.Object(newest) if newest else None
+                self.fetches += 1
+                try:
+                    async for entry in guild.audit_logs(limit=self.fetch_limit, after=after):
+                        self.add(entry)
+                except discord.HTTPException as e:
+                    print(f"Audit log fetch failed in {guild.id}: {e}")
+                    break
+                self._drop_resolved(guild.id)
+                if self.waiters.get(guild.id):
+                    # The entry may not be written yet; give Discord a moment
+                    await asyncio.sleep(POLL_DELAY)
+        finally:
+            self.polls.pop(guild.id, None)
+
+    def _drop_resolved(self, guild_id):
+        waiters = self.waiters.get(guild_id, {})
+        for key in list(waiters):
+            waiters[key] = [future for future in waiters[key] if not future.done()]
+            if not waiters[key]:
+                del waiters[key]
+
+    async def changes_by(self, guild, user_id, since):
+        """Map each action user_id took since the timestamp to the ids of its targets"""
+        after = discord.utils.time_snowflake(datetime.fromtimestamp(since, timezone.utc))
+        changes = defaultdict(set)
+        for (action, target_id), (entry_id, user, _) in self.entries.get(guild.id, {}).items():
+            if user.id == user_id and entry_id > after and target_id:
+                changes[action].add(target_id)
+        # The index only holds the newest entry per target for a short while; ask for the rest
+        self.fetches += 1
+        try:
+            async for entry in guild.audit_logs(limit=None, user=discord.Object(user_id), after=discord.Object(after)):
+                self.add(entry)
+                target_id = getattr(entry.target, "id", None)
+                if target_id:
+                    changes[entry.action].add(target_id)
+        except discord.HTTPException as e:
+            print(f"Audit log fetch failed in {guild.id}: {e}")
+        return changes
+
+    def forget(self, guild_id):
+        self.entries.pop(guild_id, None)
+        self.newest.pop(guild_id, None)
+
+    def stats(self):
+        return {
+            "lookups": self.lookups,
+            "fetches": self.fetches,
+            "fetches_per_lookup": self.fetches / self.lookups if self.lookups else 0.0,
+        }
@@ -0,0 +1,60 @@
+import time
+
+class NukeDetector:
+    """Counts destructive actions per (guild, actor, action) over sliding windows"""
+
+    def __init__(self, thresholds):
+        self.thresholds = thresholds
+        # (guild_id, actor_id, action) -> [next slot, newest timestamp, count timestamps...]
+        self.rings = {}
+        self.events = 0
+        self.triggers = 0
+
+    def __len__(self):
+        return len(self.rings)
+
+    def record(self, guild_id, actor_id, action, now=None):
+        """Count one event; return True when it takes the actor to the threshold"""
+        limit = self.thresholds.get(action)
+        if limit is None:
+            return False
+        count, window = limit
+        if now is None:
+            now = time.monotonic()
+        self.events += 1
+
+        key = (guild_id, actor_id, action)
+        ring = self.rings.get(key)
+        if ring is None:
+            ring = self.rings[key] = [2, now] + [None] * count
+        slot = ring[0]
+        ring[slot] = now
+        ring[1] = now
+        slot = slot + 1 if slot <= count else 2
+        ring[0] = slot
+
+        # The next slot holds the oldest of the last count events
+        oldest = ring[slot]
+        if oldest is None or now - oldest > window:
+            return False
+        # Start over so the same burst does not fire again on every further event
+        del self.rings[key]
+        self.triggers += 1
+        return True
+
+    def reset(self, guild_id, actor_id):
+        """Forget an actor's counts in a guild, e.g. once they have been dealt with"""
+        for action in self.thresholds:
+            self.rings.pop((guild_id, actor_id, action), None)
+
+    def sweep(self, now=None):
+        """Drop rings whose newest event has left its window; returns how many were dropped"""
+        if now is None:
+            now = time.monotonic()
+        stale = [
+            key for key, ring in self.rings.items()
+            if now - ring[1] > self.thresholds[key[2]][1]
+        ]
+        for key in stale:
+            del self.rings[key]
+        return len(stale)
@@ -0,0 +1,125 @@
+import asyncio
+import concurrent.futures
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import yt_dlp
+from config import EXTRACT_WORKERS, EXTRACT_PER_GUILD, EXTRACT_TIMEOUT, PLAYLIST_CHUNK_SIZE
+
+def ytdl_extract(query, options):
+    """Blocking yt-dlp lookup; only ever called from a worker thread"""
+    with yt_dlp.YoutubeDL(options) as ytdl:
+        return ytdl.extract_info(query, download=False)
+
+# Pointer results followed before giving up on a playlist link
+MAX_REDIRECTS = 5
+
+def ytdl_playlist_entries(url, options):
+    """Yield flat playlist entries, fetching playlist pages only as they are consumed"""
+    with yt_dlp.YoutubeDL({**options, "extract_flat": "in_playlist", "lazy_playlist": True}) as ytdl:
+        info = ytdl.extract_info(url, download=False, process=False)
+        # watch?list= without v=, music.youtube.com and other redirecting extractors
+        # first answer with a pointer to the real page
+        for _ in range(MAX_REDIRECTS):
+            if info.get("_type") not in ("url", "url_transparent"):
+                break
+            info = ytdl.extract_info(info["url"], download=False, process=False, ie_key=info.get("ie_key"))
+        else:
+            raise ValueError("That playlist link redirects too many times.")
+        
+        if "entries" in info:
+            yield from info["entries"]
+        elif info.get("id") and info.get("webpage_url"):
+            # The link led to a single video; hand it over in flat entry form
+            yield {
+                "id": info["id"],
+                "ie_key": info.get("extractor_key"),
+                "title": info.get("title"),
+                "duration": info.get("duration"),
+                "thumbnails": info.get("thumbnails"),
+                "url": info["webpage_url"],
+            }
+        else:
+            raise ValueError("That link does not lead to a playlist.")
+
+class Extractor:
+    """Runs yt-dlp lookups on a bounded thread pool so the event loop never blocks"""
+
+    # Each guild gets per_guild lookups in flight, each abandoned after timeout seconds;
+    # a lookup still waiting for a worker is dropped when its caller is cancelled
+    def __init__(self, ytdl_options, extract=ytdl_extract, playlist_entries=ytdl_playlist_entries,
+                 workers=EXTRACT_WORKERS, per_guild=EXTRACT_PER_GUILD, timeout=EXTRACT_TIMEOUT):
+        self.ytdl_options = ytdl_options
+        self.extract_func = extract
+        self.playlist_func = playlist_entries
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ytdl")
+        self.per_guild = per_guild
+        self.timeout = timeout
+        self.guild_limits = {}
+
+    async def extract(self, guild_id, query, **options):
+        """Resolve query off the event loop; raises asyncio.TimeoutError on timeout"""
+        semaphore = self.guild_limits.get(guild_id)
+        if semaphore is None:
+            semaphore = self.guild_limits[guild_id] = asyncio.Semaphore(self.per_guild)
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                self.executor, self.extract_func, query, {**self.ytdl_options, **options}
+            )
+            return await asyncio.wait_for(future, self.timeout)
+
+    async def iter_playlist(self, url, chunk_size=PLAYLIST_CHUNK_SIZE):
+        """Yield lists of flat playlist entries while a worker pages through the playlist"""
+        loop = asyncio.get_running_loop()
+        # At most two chunks buffered; the first entry goes alone so playback starts right away
+        chunks = asyncio.Queue(maxsize=2)
+        # Set once the caller stops iterating (e.g. contextlib.aclosing) so the worker stops paging
+        stop = threading.Event()
+        
+        def hand_off(item):
+            future = asyncio.run_coroutine_threadsafe(chunks.put(item), loop)
+            while True:
+                try:
+                    future.result(timeout=1)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    if stop.is_set():
+                        future.cancel()
+                        return False
+        
+        def produce():
+            chunk = []
+            first = True
+            try:
+                for entry in self.playlist_func(url, self.ytdl_options):
+                    if stop.is_set():
+                        return
+                    if entry:
+                        chunk.append(entry)
+                    if chunk and (first or len(chunk) >= chunk_size):
+                        if not hand_off(chunk):
+                            return
+                        chunk = []
+                        first = False
+                if chunk and not hand_off(chunk):
+                    return
+            except Exception as e:
+                if not hand_off(e):
+                    return
+            hand_off(None)
+        
+        producer = loop.run_in_executor(self.executor, produce)
+        try:
+            while True:
+                item = await asyncio.wait_for(chunks.get(), self.timeout)
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            producer.cancel()
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
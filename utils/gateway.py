@@ -0,0 +1,53 @@
+import importlib
+import discord
+from config import MEMBER_CACHE, CHUNK_GUILDS_AT_STARTUP
+
+# Every prefix command needs these, whichever cogs are loaded
+BASE_INTENTS = ("guilds", "guild_messages", "dm_messages", "message_content")
+MEMBER_CACHE_POLICIES = ("all", "cogs", "none")
+
+def cog_needs(cogs):
+    """Collect the INTENTS and MEMBER_CACHE tuples the cog modules declare"""
+    intents = set(BASE_INTENTS)
+    cache = set()
+    for name in cogs:
+        module = importlib.import_module(name)
+        intents.update(getattr(module, "INTENTS", ()))
+        cache.update(getattr(module, "MEMBER_CACHE", ()))
+    return intents, cache
+
+def build_intents(names):
+    intents = discord.Intents.none()
+    for name in names:
+        setattr(intents, name, True)
+    return intents
+
+def member_cache_flags(policy, intents, wanted=()):
+    """MemberCacheFlags for a MEMBER_CACHE policy, limited to what intents can feed.
+
+    "all" caches every member discord.py can see, "cogs" only the kinds the
+    cogs asked for, "none" nothing but the bot's own member. Members that
+    are not cached still arrive on the events and messages that mention them.
+    """
+    if policy not in MEMBER_CACHE_POLICIES:
+        raise ValueError(f"MEMBER_CACHE must be one of {', '.join(MEMBER_CACHE_POLICIES)}, not {policy!r}")
+    if policy == "all":
+        return discord.MemberCacheFlags.from_intents(intents)
+    flags = discord.MemberCacheFlags.none()
+    if policy == "cogs":
+        supported = discord.MemberCacheFlags.from_intents(intents)
+        for name in wanted:
+            setattr(flags, name, getattr(supported, name))
+    return flags
+
+def gateway_settings(cogs, policy=MEMBER_CACHE, chunk=CHUNK_GUILDS_AT_STARTUP):
+    """Bot keyword arguments for the intents and member cache the cogs need"""
+    names, wanted = cog_needs(cogs)
+    intents = build_intents(names)
+    if chunk and not intents.members:
+        raise ValueError("CHUNK_GUILDS_AT_STARTUP needs a cog that declares the members intent")
+    return {
+        "intents": intents,
+        "member_cache_flags": member_cache_flags(policy, intents, wanted),
+        "chunk_guilds_at_startup": chunk,
+    }
@@ -0,0 +1,260 @@
+import asyncio
+import bisect
+import re
+import time
+from aiohttp import web
+import discord
+from config import LOOP_LAG_INTERVAL
+
+# Upper bounds in seconds; the last bucket catches everything slower
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate the q-quantile by interpolating inside its bucket, as Prometheus does"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) - 1 else lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-2]
+
+class Family:
+    """One metric name with a value per combination of label values"""
+
+    def __init__(self, kind, name, help, labels=()):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def observe(self, value, *labels):
+        histogram = self.values.get(labels)
+        if histogram is None:
+            histogram = self.values[labels] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def merged(self):
+        """One histogram across every label combination"""
+        merged = Histogram()
+        for histogram in self.values.values():
+            merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+            merged.sum += histogram.sum
+            merged.count += histogram.count
+        return merged
+
+    def total(self):
+        if self.kind == "histogram":
+            return sum(histogram.count for histogram in self.values.values())
+        return sum(self.values.values())
+
+    def _labels(self, values, extra=None):
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, value in sorted(self.values.items()):
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{self._labels(values)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, value.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket = self._labels(values, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(values)} {value.sum}")
+            lines.append(f"{self.name}_count{self._labels(values)} {value.count}")
+        return lines
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics:
+    def __init__(self):
+        self.families = {}
+        # Called before every render to refresh gauges read from elsewhere
+        self.collectors = []
+
+    def _family(self, kind, name, help, labels):
+        if name not in self.families:
+            self.families[name] = Family(kind, name, help, labels)
+        return self.families[name]
+
+    def histogram(self, name, help, labels=()):
+        return self._family("histogram", name, help, labels)
+
+    def counter(self, name, help, labels=()):
+        return self._family("counter", name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self._family("gauge", name, help, labels)
+
+    def render(self):
+        for collect in self.collectors:
+            collect()
+        lines = []
+        for family in self.families.values():
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+COMMAND_SECONDS = metrics.histogram("bot_command_duration_seconds", "Command run time, from before_invoke to after_invoke", ("command", "status"))
+LISTENER_SECONDS = metrics.histogram("bot_listener_duration_seconds", "Event listener run time", ("event", "listener"))
+LOOP_LAG = metrics.histogram("bot_event_loop_lag_seconds", "How late the event loop woke a sleeping task")
+DB_READ_SECONDS = metrics.histogram("bot_db_read_duration_seconds", "Reader pool queries, including the wait for a connection", ("table",))
+DB_WRITE_SECONDS = metrics.histogram("bot_db_write_duration_seconds", "Writer jobs, including the commit", ("job",))
+DB_WRITE_WAIT = metrics.histogram("bot_db_write_wait_seconds", "Time a write job spent queued behind others")
+REST_REQUESTS = metrics.counter("bot_rest_requests_total", "Discord REST calls by route template and outcome", ("method", "route", "status"))
+REST_SECONDS = metrics.histogram("bot_rest_duration_seconds", "Discord REST call time, including rate-limit waits", ("method", "route"))
+GUILDS = metrics.gauge("bot_guilds", "Guilds this process is in")
+SHARD_LATENCY = metrics.gauge("bot_shard_latency_seconds", "Gateway heartbeat latency per shard", ("shard",))
+
+TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+(\w+)", re.IGNORECASE)
+
+def query_table(query):
+    """First table a query touches, used as the label for its timing"""
+    match = TABLE.search(query)
+    return match.group(1) if match else "other"
+
+def job_name(job):
+    """Name a Database write job after the method that built it"""
+    parts = job.__qualname__.split(".")
+    return parts[-3] if len(parts) >= 3 and parts[-2] == "<locals>" else parts[-1]
+
+def instrument_bot(bot):
+    """Time commands, listeners and REST calls and export the bot's gauges"""
+
+    @bot.before_invoke
+    async def start_timer(ctx):
+        ctx.started_at = time.perf_counter()
+
+    @bot.after_invoke
+    async def stop_timer(ctx):
+        started_at = getattr(ctx, "started_at", None)
+        if started_at is not None:
+            status = "error" if ctx.command_failed else "ok"
+            COMMAND_SECONDS.observe(time.perf_counter() - started_at, ctx.command.qualified_name, status)
+
+    # Every listener, cog or bot.event, is scheduled through _run_event
+    run_event = bot._run_event
+
+    async def timed_event(coro, event_name, *args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            await run_event(coro, event_name, *args, **kwargs)
+        finally:
+            LISTENER_SECONDS.observe(time.perf_counter() - started_at, event_name, coro.__qualname__)
+
+    bot._run_event = timed_event
+
+    request = bot.http.request
+
+    async def timed_request(route, **kwargs):
+        started_at = time.perf_counter()
+        status = "ok"
+        try:
+            return await request(route, **kwargs)
+        except discord.HTTPException as e:
+            status = str(e.status)
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            REST_REQUESTS.inc(route.method, route.path, status)
+            REST_SECONDS.observe(time.perf_counter() - started_at, route.method, route.path)
+
+    bot.http.request = timed_request
+
+    def collect():
+        GUILDS.set(len(bot.guilds))
+        for shard_id, latency in bot.latencies:
+            if latency == latency:  # NaN until the first heartbeat
+                SHARD_LATENCY.set(latency, str(shard_id))
+
+    metrics.collectors.append(collect)
+
+class LoopLagMonitor:
+    """Sleeps interval seconds at a time and records how much later than asked it woke up"""
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.last = 0.0
+        self.worst = 0.0
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            # Whatever blocked the loop delayed this task too, so the overshoot is the lag
+            self.last = max(loop.time() - started - self.interval, 0.0)
+            self.worst = max(self.worst, self.last)
+            LOOP_LAG.observe(self.last)
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+loop_lag = LoopLagMonitor()
+
+# Version 0.0.4 of the text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class MetricsServer:
+    """Serves metrics.render() at /metrics in the Prometheus text format"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+
+    async def handle(self, request):
+        return web.Response(text=metrics.render(), headers={"Content-Type": CONTENT_TYPE})
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,76 @@
+import asyncio
+import time
+from collections import OrderedDict
+from database.database import db
+from config import NAME_CACHE_SIZE, NAME_CACHE_TTL, NAME_FETCH_CONCURRENCY
+
+class NameResolver:
+    """Turns user ids into display names with as few REST calls as possible"""
+
+    # Lookup order: gateway cache, this TTL'd LRU, users.username, then bot.fetch_user
+    def __init__(self, maxsize=NAME_CACHE_SIZE, ttl=NAME_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.cache = OrderedDict()
+        self.semaphore = asyncio.Semaphore(NAME_FETCH_CONCURRENCY)
+
+    def _cached(self, user_id):
+        entry = self.cache.get(user_id)
+        if entry is None:
+            return None
+        name, expires = entry
+        if expires < time.monotonic():
+            del self.cache[user_id]
+            return None
+        self.cache.move_to_end(user_id)
+        return name
+
+    def _remember(self, user_id, name):
+        self.cache[user_id] = (name, time.monotonic() + self.ttl)
+        self.cache.move_to_end(user_id)
+        while len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+
+    async def _fetch(self, bot, user_id):
+        async with self.semaphore:
+            try:
+                user = await bot.fetch_user(user_id)
+            except Exception:
+                return None
+        self._remember(user_id, user.name)
+        return user.name
+
+    async def resolve(self, bot, user_ids, guild=None):
+        """Return {user_id: name} for every id, falling back to 'User <id>'"""
+        names = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            user = (guild and guild.get_member(user_id)) or bot.get_user(user_id)
+            name = user.name if user else self._cached(user_id)
+            if name:
+                names[user_id] = name
+            else:
+                missing.append(user_id)
+
+        if missing and db.db:
+            placeholders = ', '.join('?' for _ in missing)
+            rows = await db.fetchall(
+                f'SELECT user_id, username FROM users WHERE user_id IN ({placeholders}) AND username IS NOT NULL',
+                missing
+            )
+            for user_id, username in rows:
+                names[user_id] = username
+                self._remember(user_id, username)
+            missing = [user_id for user_id in missing if user_id not in names]
+
+        if missing:
+            fetched = await asyncio.gather(*(self._fetch(bot, user_id) for user_id in missing))
+            names.update(zip(missing, fetched))
+
+        return {user_id: names.get(user_id) or f"User {user_id}" for user_id in user_ids}
+
+    async def resolve_one(self, bot, user_id, guild=None):
+        return (await self.resolve(bot, [user_id], guild))[user_id]
+
+# Global resolver instance
+name_resolver = NameResolver()
@@ -0,0 +1,50 @@
+import asyncio
+import time
+import discord
+from config import OVERWRITE_CONCURRENCY, PROGRESS_INTERVAL
+
+def missing_channels(guild, target, overwrite):
+    """Channels the bot may edit where target's overwrite does not yet set what overwrite sets.
+
+    The guild's own channel state is the record of what a previous run
+    finished, so an interrupted job resumes by recomputing this list.
+    Permissions overwrite leaves unset may be customised freely.
+    """
+    wanted = [(name, value) for name, value in overwrite if value is not None]
+    return [
+        channel for channel in guild.channels
+        # Without Manage Permissions in a channel every attempt there is a 403
+        if channel.permissions_for(guild.me).manage_roles
+        and any(getattr(channel.overwrites_for(target), name) != value for name, value in wanted)
+    ]
+
+async def apply_overwrites(channels, target, overwrite, progress=None, concurrency=OVERWRITE_CONCURRENCY):
+    """Set target's overwrite on every channel, concurrently; returns (done, failed channels).
+
+    Every channel's permissions route is its own rate-limit bucket, so the
+    only shared limit is the global one; concurrency keeps well under it
+    and discord.py waits out any 429. progress(done, failed, total) is
+    awaited at most every PROGRESS_INTERVAL seconds and once at the end.
+    """
+    limit = asyncio.Semaphore(concurrency)
+    total = len(channels)
+    done = 0
+    failed = []
+    last_report = time.monotonic()
+
+    async def apply(channel):
+        nonlocal done, last_report
+        async with limit:
+            try:
+                await channel.set_permissions(target, overwrite=overwrite, reason="Setting up muted role")
+                done += 1
+            except (discord.HTTPException, discord.ClientException):
+                failed.append(channel)
+        if progress and time.monotonic() - last_report >= PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            await progress(done, len(failed), total)
+
+    await asyncio.gather(*(apply(channel) for channel in channels))
+    if progress:
+        await progress(done, len(failed), total)
+    return done, failed
@@ -0,0 +1,176 @@
+import asyncio
+import time
+from collections import deque
+import discord
+from database.database import db
+from config import PREFETCH_DEPTH
+
+class Track:
+    """One queue entry. Holds ids rather than discord objects to stay small."""
+
+    __slots__ = ("track_id", "title", "duration", "thumbnail", "webpage_url", "requester_id", "position")
+
+    def __init__(self, track_id, title, duration, thumbnail, webpage_url, requester_id, position=None):
+        self.track_id = track_id
+        self.title = title
+        self.duration = duration
+        self.thumbnail = thumbnail
+        self.webpage_url = webpage_url
+        self.requester_id = requester_id
+        # Row position in music_queue, assigned when the track is enqueued
+        self.position = position
+
+    @classmethod
+    def from_row(cls, row, requester_id):
+        """Build a Track from a database TrackRow"""
+        return cls(row.track_id, row.title, row.duration, row.thumbnail, row.webpage_url, requester_id)
+
+    @property
+    def requester_mention(self):
+        return f"<@{self.requester_id}>"
+
+class GuildPlayer:
+    """Queue and playback state for one guild"""
+
+    def __init__(self, bot, guild_id, resolver, ffmpeg_options, on_start=None, on_empty=None, on_error=None):
+        self.bot = bot
+        self.guild_id = guild_id
+        self.resolver = resolver
+        self.ffmpeg_options = ffmpeg_options
+        self.on_start = on_start
+        self.on_empty = on_empty
+        self.on_error = on_error
+        # Mirrored to music_queue; the playing song's row stays until the next starts
+        self.queue = deque()
+        self.now_playing = None
+        self.next_position = 0
+        # Voice channel to rejoin when a restored queue is resumed
+        self.voice_channel_id = None
+        self.text_channel_id = None
+        # song.position -> Task resolving to a ready FFmpegOpusAudio, for the next PREFETCH_DEPTH songs
+        self.prepared = {}
+        # Seconds between one song ending and the next starting
+        self.ended_at = None
+        self.gaps = deque(maxlen=100)
+        # One play_next at a time, so a !play during a skip can't start a second song
+        self.lock = asyncio.Lock()
+
+    @property
+    def voice_client(self):
+        guild = self.bot.get_guild(self.guild_id)
+        return guild.voice_client if guild else None
+
+    async def _prepare(self, song):
+        stream_url = await self.resolver.stream_url(self.guild_id, song.track_id, song.webpage_url)
+        return discord.FFmpegOpusAudio(stream_url, **self.ffmpeg_options)
+
+    def restore(self, tracks, voice_channel_id, text_channel_id):
+        """Load a queue saved by a previous run; nothing is connected or played yet"""
+        self.queue.extend(tracks)
+        self.voice_channel_id = voice_channel_id
+        self.text_channel_id = text_channel_id
+        if tracks:
+            self.next_position = tracks[-1].position + 1
+
+    async def enqueue(self, tracks):
+        for track in tracks:
+            track.position = self.next_position
+            self.next_position += 1
+        self.queue.extend(tracks)
+        await db.add_music_tracks(self.guild_id, tracks)
+
+    def prefetch(self):
+        """Start preparing sources for the next few queue entries"""
+        upcoming = {song.position for song in list(self.queue)[:PREFETCH_DEPTH]}
+        for key in list(self.prepared):
+            if key not in upcoming:
+                self._discard(self.prepared.pop(key))
+        for song in list(self.queue)[:PREFETCH_DEPTH]:
+            if song.position not in self.prepared:
+                self.prepared[song.position] = asyncio.create_task(self._prepare(song))
+
+    def _discard(self, task):
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled() and task.exception() is None:
+            task.result().cleanup()
+
+    def _after(self, error):
+        # Runs on the voice thread once the current source is exhausted
+        if error:
+            print(f"Error in playback: {error}")
+        self.ended_at = time.perf_counter()
+        asyncio.run_coroutine_threadsafe(self.play_next(), self.bot.loop)
+
+    async def play_next(self):
+        async with self.lock:
+            await self._play_next()
+
+    async def _play_next(self):
+        while True:
+            if not self.queue:
+                self.now_playing = None
+                self.ended_at = None
+                await self.forget()
+                if self.on_empty:
+                    await self.on_empty(self)
+                return
+
+            voice_client = self.voice_client
+            if voice_client is None:
+                # Disconnected: keep the saved queue so it can be resumed later
+                self.now_playing = None
+                self.release()
+                return
+            if voice_client.is_playing() or voice_client.is_paused():
+                # Another call started a song while this one waited for the lock
+                return
+
+            song = self.queue.popleft()
+            self.now_playing = song
+            await db.trim_music_queue(self.guild_id, song.position)
+            task = self.prepared.pop(song.position, None)
+            source = None
+            try:
+                source = await task if task else await self._prepare(song)
+                voice_client.play(source, after=self._after)
+                break
+            except Exception as e:
+                # Skip the broken entry rather than stalling the whole queue
+                if source:
+                    source.cleanup()
+                self.now_playing = None
+                if self.on_error:
+                    await self.on_error(self, song, e)
+                self.prefetch()
+        self.prefetch()
+
+        if self.ended_at is not None:
+            self.gaps.append(time.perf_counter() - self.ended_at)
+            self.ended_at = None
+        if self.on_start:
+            await self.on_start(self, song)
+
+    def release(self):
+        """Drop prepared sources without touching the saved queue"""
+        for task in self.prepared.values():
+            self._discard(task)
+        self.prepared.clear()
+
+    async def clear(self):
+        self.queue.clear()
+        self.now_playing = None
+        self.release()
+        await self.forget()
+
+    async def forget(self):
+        """Drop the saved queue and player row; the next !play saves the channels again"""
+        self.voice_channel_id = None
+        self.text_channel_id = None
+        await db.clear_music_state(self.guild_id)
+
+    def gap_stats(self):
+        """Return (count, average, worst) transition gap in seconds"""
+        if not self.gaps:
+            return 0, 0.0, 0.0
+        return len(self.gaps), sum(self.gaps) / len(self.gaps), max(self.gaps)
@@ -0,0 +1,95 @@
+import time
+import discord
+from config import PURGE_SCAN_LIMIT, PROGRESS_INTERVAL
+
+# Bulk delete only accepts messages younger than 14 days; keep a margin for clock skew
+BULK_DELETE_AGE = 14 * 24 * 3600 - 600
+BULK_DELETE_SIZE = 100
+
+class PurgeStats:
+    __slots__ = ("scanned", "bulk", "single", "failed", "cancelled")
+
+    def __init__(self):
+        self.scanned = 0
+        self.bulk = 0
+        self.single = 0
+        self.failed = 0
+        self.cancelled = False
+
+    @property
+    def deleted(self):
+        return self.bulk + self.single
+
+async def matching_messages(channel, check, before=None, scan_limit=PURGE_SCAN_LIMIT, stats=None):
+    """Walk channel history newest first, yielding messages check() accepts.
+
+    discord.py fetches history one page at a time as this is consumed, so
+    nothing beyond the current page is held in memory.
+    """
+    async for message in channel.history(limit=scan_limit, before=before):
+        if stats:
+            stats.scanned += 1
+        if check is None or check(message):
+            yield message
+
+async def purge_messages(channel, amount, check=None, before=None, scan_limit=PURGE_SCAN_LIMIT, cancel=None, progress=None):
+    """Delete up to amount messages matching check; returns PurgeStats.
+
+    Matches younger than 14 days are deleted 100 per bulk-delete call. Older
+    ones can only be deleted one at a time; those calls share one rate-limit
+    bucket, so they go out sequentially and discord.py waits out any 429.
+    Setting the cancel event stops the purge after the current call.
+    progress(stats) is awaited at most every PROGRESS_INTERVAL seconds.
+    """
+    stats = PurgeStats()
+    batch = []
+    last_report = time.monotonic()
+    cutoff = time.time() - BULK_DELETE_AGE
+
+    async def flush():
+        try:
+            if len(batch) == 1:
+                await batch[0].delete()
+            else:
+                await channel.delete_messages(batch)
+            stats.bulk += len(batch)
+        except discord.NotFound:
+            # Someone else deleted one of them; fall back to one by one
+            for message in batch:
+                await delete_one(message, counted_as="bulk")
+        except discord.HTTPException:
+            stats.failed += len(batch)
+        batch.clear()
+
+    async def delete_one(message, counted_as="single"):
+        try:
+            await message.delete()
+            setattr(stats, counted_as, getattr(stats, counted_as) + 1)
+        except discord.NotFound:
+            pass
+        except discord.HTTPException:
+            stats.failed += 1
+
+    matched = 0
+    async for message in matching_messages(channel, check, before, scan_limit, stats):
+        if cancel and cancel.is_set():
+            stats.cancelled = True
+            break
+        matched += 1
+        if message.created_at.timestamp() >= cutoff:
+            batch.append(message)
+            if len(batch) >= BULK_DELETE_SIZE:
+                await flush()
+        else:
+            # History is newest first, so everything from here on is too old for bulk delete
+            if batch:
+                await flush()
+            await delete_one(message)
+        if progress and time.monotonic() - last_report >= PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            await progress(stats)
+        if matched >= amount:
+            break
+    if batch and not stats.cancelled:
+        await flush()
+    return stats
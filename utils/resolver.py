@@ -0,0 +1,148 @@
+import re
+import time
+from urllib.parse import urlparse, parse_qs
+from database.database import db, TrackRow
+from utils.search import SearchIndex
+from config import STREAM_URL_TTL, TRACK_CACHE_SIZE
+
+YOUTUBE_ID = re.compile(r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/)|youtu\.be/)([\w-]{11})")
+
+# Refresh a stream URL this many seconds before it actually expires
+STREAM_URL_MARGIN = 60
+
+def normalize_query(query):
+    """Map a !play argument to a cache key: a track id for YouTube links, else the cleaned query"""
+    query = query.strip()
+    match = YOUTUBE_ID.search(query)
+    if match:
+        return f"youtube:{match.group(1)}"
+    if query.startswith(("http://", "https://")):
+        return query
+    return " ".join(query.lower().split())
+
+def stream_expiry(url):
+    expire = parse_qs(urlparse(url).query).get("expire")
+    if expire and expire[0].isdigit():
+        return int(expire[0])
+    return time.time() + STREAM_URL_TTL
+
+def track_from_info(info):
+    return TrackRow(
+        f"{info.get('extractor_key', 'generic').lower()}:{info['id']}",
+        info["title"],
+        info.get("duration") or 0,
+        info.get("thumbnail"),
+        info.get("webpage_url") or info["url"],
+    )
+
+def track_from_entry(entry):
+    """Build a TrackRow from a flat playlist entry; the stream URL is resolved later"""
+    thumbnails = entry.get("thumbnails") or []
+    return TrackRow(
+        f"{(entry.get('ie_key') or 'generic').lower()}:{entry['id']}",
+        entry.get("title") or entry["url"],
+        entry.get("duration") or 0,
+        thumbnails[-1]["url"] if thumbnails else None,
+        entry["url"],
+    )
+
+def is_playlist(query):
+    parsed = urlparse(query.strip())
+    if parsed.scheme not in ("http", "https"):
+        return False
+    return "list" in parse_qs(parsed.query) or "/playlist" in parsed.path or "/sets/" in parsed.path
+
+class TrackResolver:
+    """Resolves !play queries to tracks, going to yt-dlp only on a cache miss"""
+
+    def __init__(self, extractor):
+        self.extractor = extractor
+        # Metadata lives in the tracks table; stream URLs expire within hours, so they stay
+        # here as track_id -> (url, expiry) and are re-resolved before playback when stale
+        self.stream_urls = {}
+        # Titles of cached tracks, tried for free-text queries before a network search
+        self.index = SearchIndex()
+        self.hits = 0
+        self.index_hits = 0
+        self.misses = 0
+        self.stream_hits = 0
+        self.stream_misses = 0
+
+    def _remember_stream(self, track_id, url):
+        if len(self.stream_urls) >= TRACK_CACHE_SIZE:
+            now = time.time()
+            self.stream_urls = {k: v for k, v in self.stream_urls.items() if v[1] > now}
+        self.stream_urls[track_id] = (url, stream_expiry(url))
+
+    async def load(self):
+        """Build the search index from the tracks table"""
+        self.index.load(await db.get_track_titles())
+    
+    async def _store(self, track, query=None):
+        for track_id in await db.cache_track(track, query):
+            self.index.remove(track_id)
+        self.index.add(track.track_id, track.title)
+    
+    async def resolve(self, guild_id, query):
+        key = normalize_query(query)
+        track = await db.get_track(key)
+        if track:
+            self.hits += 1
+            return track
+        
+        if not key.startswith(("http://", "https://", "youtube:")):
+            track_id = self.index.best(key)
+            track = await db.get_track(track_id) if track_id else None
+            if track:
+                self.hits += 1
+                self.index_hits += 1
+                return track
+            if track_id:
+                self.index.remove(track_id)
+
+        self.misses += 1
+        info = await self.extractor.extract(guild_id, query)
+        if "entries" in info:
+            entries = list(info["entries"])
+            if not entries:
+                raise ValueError(f"No results for {query}")
+            info = entries[0]
+
+        track = track_from_info(info)
+        if info.get("url"):
+            self._remember_stream(track.track_id, info["url"])
+        await self._store(track, None if key == track.track_id else key)
+        return track
+    
+    def suggest(self, query, limit=5):
+        """Return [(track_id, title, corrected_query)] of cached tracks resembling query"""
+        return [
+            (track_id, self.index.titles[track_id][0], corrected)
+            for track_id, _, corrected in self.index.search(query, limit)
+        ]
+
+    async def stream_url(self, guild_id, track_id, webpage_url):
+        """Return a playable stream URL, re-resolving it if missing or about to expire"""
+        entry = self.stream_urls.get(track_id)
+        if entry and entry[1] - STREAM_URL_MARGIN > time.time():
+            self.stream_hits += 1
+            return entry[0]
+
+        self.stream_misses += 1
+        info = await self.extractor.extract(guild_id, webpage_url)
+        self._remember_stream(track_id, info["url"])
+        return info["url"]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        streams = self.stream_hits + self.stream_misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "index_hits": self.index_hits,
+            "indexed": len(self.index),
+            "stream_hits": self.stream_hits,
+            "stream_misses": self.stream_misses,
+            "stream_hit_rate": self.stream_hits / streams if streams else 0.0,
+        }
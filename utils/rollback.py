@@ -0,0 +1,234 @@
+import asyncio
+import json
+import zlib
+from collections import defaultdict
+import discord
+
+# Snapshot rows; kept as plain lists so a whole guild packs into one small blob
+# role:    [id, name, permissions, colour, hoist, mentionable, position]
+# channel: [id, kind, name, category_id, position, topic, nsfw, slowmode, bitrate, user_limit, overwrites]
+# overwrite: [target_id, is_role, allow, deny]
+CHANNEL_KINDS = {
+    discord.ChannelType.text: "text",
+    discord.ChannelType.news: "text",
+    discord.ChannelType.voice: "voice",
+    discord.ChannelType.category: "category",
+}
+
+# Audit-log actions that mark a role or channel as the banned actors' doing
+ROLE_CREATES = (discord.AuditLogAction.role_create,)
+ROLE_EDITS = (discord.AuditLogAction.role_update,)
+ROLE_DELETES = (discord.AuditLogAction.role_delete,)
+CHANNEL_CREATES = (discord.AuditLogAction.channel_create,)
+CHANNEL_EDITS = (
+    discord.AuditLogAction.channel_update, discord.AuditLogAction.overwrite_create,
+    discord.AuditLogAction.overwrite_update, discord.AuditLogAction.overwrite_delete,
+)
+CHANNEL_DELETES = (discord.AuditLogAction.channel_delete,)
+
+def overwrite_rows(channel):
+    rows = []
+    for target, overwrite in channel.overwrites.items():
+        allow, deny = overwrite.pair()
+        rows.append([target.id, isinstance(target, discord.Role), allow.value, deny.value])
+    return sorted(rows)
+
+def snapshot_guild(guild):
+    """Capture roles, channels and permission overwrites as a JSON-able dict"""
+    roles = [
+        [role.id, role.name, role.permissions.value, role.colour.value, role.hoist, role.mentionable, role.position]
+        for role in guild.roles
+        if not role.managed
+    ]
+    channels = []
+    for channel in guild.channels:
+        kind = CHANNEL_KINDS.get(channel.type)
+        if kind is None:
+            continue
+        channels.append([
+            channel.id, kind, channel.name, channel.category_id, channel.position,
+            getattr(channel, "topic", None), getattr(channel, "nsfw", False),
+            getattr(channel, "slowmode_delay", 0), getattr(channel, "bitrate", None),
+            getattr(channel, "user_limit", None), overwrite_rows(channel),
+        ])
+    return {"roles": roles, "channels": channels}
+
+def pack(snapshot):
+    return zlib.compress(json.dumps(snapshot, separators=(",", ":")).encode())
+
+def unpack(data):
+    return json.loads(zlib.decompress(data))
+
+class RollbackExecutor:
+    """Runs API calls concurrently, one lane per rate-limit bucket"""
+
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+
+    async def run(self, operations):
+        """Run (bucket, coroutine function) pairs; returns (succeeded, failed)"""
+        # Calls sharing a bucket run one after another; discord.py still handles any 429
+        lanes = defaultdict(list)
+        for bucket, call in operations:
+            lanes[bucket].append(call)
+        limit = asyncio.Semaphore(self.concurrency)
+        succeeded = 0
+        failed = 0
+
+        async def lane(calls):
+            nonlocal succeeded, failed
+            for call in calls:
+                async with limit:
+                    try:
+                        await call()
+                        succeeded += 1
+                    except (discord.HTTPException, discord.ClientException) as e:
+                        print(f"Rollback step failed: {e}")
+                        failed += 1
+
+        await asyncio.gather(*(lane(calls) for calls in lanes.values()))
+        return succeeded, failed
+
+class Rollback:
+    """Undo, against a snapshot, what the audit log says the banned actors did"""
+
+    def __init__(self, guild, snapshot, changes, executor):
+        self.guild = guild
+        self.snapshot = snapshot
+        # audit-log action -> ids of the roles and channels the banned actors did it to
+        self.changes = changes
+        self.executor = executor
+        # snapshot id -> id of the recreated object
+        self.id_map = {}
+        # Snapshot channel ids already handed to the executor
+        self.planned = set()
+
+    def _touched(self, actions, target_id):
+        return any(target_id in self.changes.get(action, ()) for action in actions)
+
+    def _overwrites(self, rows):
+        overwrites = {}
+        for target_id, is_role, allow, deny in rows:
+            target_id = self.id_map.get(target_id, target_id)
+            if is_role:
+                target = self.guild.get_role(target_id)
+            else:
+                target = self.guild.get_member(target_id) or discord.Object(target_id)
+            if target is not None:
+                overwrites[target] = discord.PermissionOverwrite.from_pair(
+                    discord.Permissions(allow), discord.Permissions(deny)
+                )
+        return overwrites
+
+    def plan_roles(self):
+        guild = self.guild
+        saved = {row[0]: row for row in self.snapshot["roles"]}
+        operations = []
+        for role in guild.roles:
+            row = saved.get(role.id)
+            if row is None:
+                if not role.managed and not role.is_default() and self._touched(ROLE_CREATES, role.id):
+                    operations.append((("DELETE", "role", guild.id), role.delete))
+            elif (role.permissions.value != row[2] or role.name != row[1]) and self._touched(ROLE_EDITS, role.id):
+                operations.append((
+                    ("PATCH", "role", guild.id),
+                    lambda role=role, row=row: role.edit(name=row[1], permissions=discord.Permissions(row[2]))
+                ))
+        for role_id, row in saved.items():
+            if guild.get_role(role_id) is None and self._touched(ROLE_DELETES, role_id):
+                operations.append((("POST", "role", guild.id), lambda row=row: self._create_role(row)))
+        return operations
+
+    async def _create_role(self, row):
+        role_id, name, permissions, colour, hoist, mentionable, _ = row
+        role = await self.guild.create_role(
+            name=name, permissions=discord.Permissions(permissions), colour=colour,
+            hoist=hoist, mentionable=mentionable, reason="Antinuke rollback"
+        )
+        self.id_map[role_id] = role.id
+
+    def plan_deletions(self):
+        saved = {row[0] for row in self.snapshot["channels"]}
+        return [
+            (("DELETE", "channel", channel.id), channel.delete)
+            for channel in self.guild.channels
+            if channel.id not in saved and self._touched(CHANNEL_CREATES, channel.id)
+        ]
+
+    def _ready(self, row):
+        """Whether every role and category this row needs recreated has been"""
+        guild = self.guild
+        category_id = row[3]
+        if (category_id and self._touched(CHANNEL_DELETES, category_id)
+                and guild.get_channel(self.id_map.get(category_id, category_id)) is None):
+            return False
+        return all(
+            guild.get_role(self.id_map.get(target_id, target_id)) is not None
+            for target_id, is_role, _, _ in row[10]
+            if is_role and self._touched(ROLE_DELETES, target_id)
+        )
+
+    def _reverts(self, channel, row):
+        """Whether channel lost something to the actors' edits or role deletions"""
+        if self._touched(CHANNEL_EDITS, row[0]):
+            return overwrite_rows(channel) != sorted(row[10]) or channel.name != row[2]
+        return any(is_role and self._touched(ROLE_DELETES, target_id) for target_id, is_role, _, _ in row[10])
+
+    def _revert_channel(self, channel, row):
+        if self._touched(CHANNEL_EDITS, row[0]):
+            return channel.edit(name=row[2], overwrites=self._overwrites(row[10]))
+        # Someone else may have edited it since; only put back the deleted roles' overwrites
+        overwrites = dict(channel.overwrites)
+        overwrites.update(self._overwrites(
+            [overwrite for overwrite in row[10] if overwrite[1] and self._touched(ROLE_DELETES, overwrite[0])]
+        ))
+        return channel.edit(name=channel.name, overwrites=overwrites)
+
+    def plan_channels(self, force=False):
+        guild = self.guild
+        operations = []
+        for row in self.snapshot["channels"]:
+            if row[0] in self.planned or not (force or self._ready(row)):
+                continue
+            self.planned.add(row[0])
+            channel = guild.get_channel(row[0])
+            if channel is None:
+                if self._touched(CHANNEL_DELETES, row[0]):
+                    operations.append((("POST", "channel", guild.id), lambda row=row: self._create_channel(row)))
+            elif self._reverts(channel, row):
+                operations.append((
+                    ("PATCH", "channel", channel.id),
+                    lambda channel=channel, row=row: self._revert_channel(channel, row)
+                ))
+        return operations
+
+    async def _create_channel(self, row):
+        channel_id, kind, name, category_id, position, topic, nsfw, slowmode, bitrate, user_limit, overwrites = row
+        guild = self.guild
+        options = {"overwrites": self._overwrites(overwrites), "position": position, "reason": "Antinuke rollback"}
+        if kind == "category":
+            channel = await guild.create_category(name, **options)
+        else:
+            category_id = self.id_map.get(category_id, category_id)
+            category = guild.get_channel(category_id) if category_id else None
+            if kind == "voice":
+                channel = await guild.create_voice_channel(
+                    name, category=category, bitrate=bitrate, user_limit=user_limit, **options
+                )
+            else:
+                channel = await guild.create_text_channel(
+                    name, category=category, topic=topic, nsfw=nsfw, slowmode_delay=slowmode, **options
+                )
+        self.id_map[channel_id] = channel.id
+
+    async def run(self):
+        """Apply the rollback; returns (succeeded, failed) API calls"""
+        succeeded = failed = 0
+        operations = self.plan_roles() + self.plan_deletions() + self.plan_channels()
+        while operations:
+            done, errors = await self.executor.run(operations)
+            succeeded += done
+            failed += errors
+            # Whatever a failed creation was blocking goes out as-is in the last phase
+            operations = self.plan_channels() or self.plan_channels(force=True)
+        return succeeded, failed
@@ -0,0 +1,206 @@
+import heapq
+import re
+import sqlite3
+import sys
+from bisect import bisect_left
+from collections import defaultdict
+
+TOKEN = re.compile(r"\w+")
+
+# Score weights for how a query token matched a title token
+EXACT, PREFIX, FUZZY = 1.0, 0.8, 0.6
+
+# Tokens shorter than these are not matched by prefix / within one edit
+MIN_PREFIX_LENGTH = 2
+MIN_FUZZY_LENGTH = 4
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+def deletes(token):
+    """All strings one deletion away from token"""
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+class SearchIndex:
+    """Inverted index from title tokens to track ids, kept in memory"""
+
+    def __init__(self):
+        self.postings = defaultdict(set)
+        # track_id -> (title, token count)
+        self.titles = {}
+        # Sorted tokens, so a prefix is a bisect range
+        self.vocabulary = []
+        # Single-character deletion -> tokens it came from, for one-edit matches
+        self.variants = defaultdict(set)
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.titles)
+
+    def load(self, entries):
+        """Replace the index with (track_id, title) entries"""
+        self.postings = defaultdict(set)
+        self.titles = {}
+        self.variants = defaultdict(set)
+        for track_id, title in entries:
+            self._add(track_id, title)
+        self.vocabulary = sorted(self.postings)
+        self.dirty = False
+
+    def _add(self, track_id, title):
+        tokens = tokenize(title)
+        self.titles[track_id] = (title, len(tokens))
+        for token in set(tokens):
+            if token not in self.postings and len(token) >= MIN_FUZZY_LENGTH:
+                for variant in deletes(token):
+                    self.variants[variant].add(token)
+            self.postings[token].add(track_id)
+
+    def add(self, track_id, title):
+        if track_id in self.titles:
+            self.remove(track_id)
+        self._add(track_id, title)
+        self.dirty = True
+
+    def remove(self, track_id):
+        entry = self.titles.pop(track_id, None)
+        if entry is None:
+            return
+        for token in set(tokenize(entry[0])):
+            ids = self.postings.get(token)
+            if ids is None:
+                continue
+            ids.discard(track_id)
+            if not ids:
+                del self.postings[token]
+                if len(token) >= MIN_FUZZY_LENGTH:
+                    for variant in deletes(token):
+                        self.variants[variant].discard(token)
+                        if not self.variants[variant]:
+                            del self.variants[variant]
+        self.dirty = True
+
+    def _prefixed(self, prefix):
+        if self.dirty:
+            self.vocabulary = sorted(self.postings)
+            self.dirty = False
+        start = bisect_left(self.vocabulary, prefix)
+        end = bisect_left(self.vocabulary, prefix + "\uffff")
+        return self.vocabulary[start:end]
+
+    def _fuzzy(self, token):
+        """Vocabulary tokens within one insertion, deletion or substitution of token"""
+        if len(token) < MIN_FUZZY_LENGTH:
+            return set()
+        found = set(self.variants.get(token, ()))
+        for variant in deletes(token):
+            if variant in self.postings:
+                found.add(variant)
+            found.update(self.variants.get(variant, ()))
+        found.discard(token)
+        return found
+
+    def _terms(self, token, last):
+        """Return [(weight, title_token)] a query token may stand for, best first"""
+        terms = [(EXACT, token)] if token in self.postings else []
+        if last and len(token) >= MIN_PREFIX_LENGTH:
+            terms += [(PREFIX, t) for t in self._prefixed(token) if t != token]
+        terms += [(FUZZY, t) for t in self._fuzzy(token)]
+        return terms
+
+    def _matches(self, terms, within=None):
+        """Return {track_id: (weight, title_token)} for the best term each track contains"""
+        matches = {}
+        for weight, term in terms:
+            ids = self.postings[term]
+            if within is not None:
+                ids = within & ids
+            for track_id in ids:
+                if track_id not in matches:
+                    matches[track_id] = (weight, term)
+        return matches
+
+    def search(self, query, limit=5):
+        """Return [(track_id, score, corrected_query)] for tracks matching every query token.
+
+        score is in (0, 1]: 1 means every query token matched exactly and the
+        title has no other words. corrected_query spells the query with the
+        title tokens that actually matched, for "did you mean" hints.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        token_terms = []
+        for i, token in enumerate(tokens):
+            terms = self._terms(token, i == len(tokens) - 1)
+            if not terms:
+                return []
+            token_terms.append(terms)
+
+        # Start from the rarest token and only look the others up within its tracks
+        size = [sum(len(self.postings[term]) for _, term in terms) for terms in token_terms]
+        order = sorted(range(len(tokens)), key=size.__getitem__)
+        per_token = [None] * len(tokens)
+        candidates = None
+        for i in order:
+            per_token[i] = self._matches(token_terms[i], candidates)
+            candidates = set(per_token[i])
+            if not candidates:
+                return []
+
+        def score(track_id):
+            weight = sum(matches[track_id][0] for matches in per_token) / len(tokens)
+            coverage = len(tokens) / max(self.titles[track_id][1], len(tokens))
+            return weight * (0.5 + 0.5 * coverage)
+
+        scored = heapq.nsmallest(limit, ((-score(track_id), track_id) for track_id in candidates))
+        return [
+            (track_id, -negative, " ".join(matches[track_id][1] for matches in per_token))
+            for negative, track_id in scored
+        ]
+
+    def best(self, query, threshold=0.8):
+        """Return the track id a query unambiguously names, or None.
+
+        Only exact and prefix matches count, the score must reach threshold
+        and the runner-up must score clearly lower. At the default threshold
+        exact matches must cover at least 60% of the title's words, so one
+        common word never stands in for a whole title.
+        """
+        results = self.search(query, limit=2)
+        if not results:
+            return None
+        track_id, score, corrected = results[0]
+        tokens = tokenize(query)
+        terms = corrected.split()
+        if tokens[:-1] != terms[:-1] or not terms[-1].startswith(tokens[-1]):
+            return None
+        if score < threshold:
+            return None
+        if len(results) > 1 and results[1][1] > score * 0.9:
+            return None
+        return track_id
+
+def compact(db_path):
+    """Drop orphaned query aliases and stale rows, then VACUUM; run with the bot stopped"""
+    conn = sqlite3.connect(db_path)
+    try:
+        orphans = conn.execute(
+            'DELETE FROM track_queries WHERE track_id NOT IN (SELECT track_id FROM tracks)'
+        ).rowcount
+        untitled = conn.execute("DELETE FROM tracks WHERE title IS NULL OR title = ''").rowcount
+        conn.commit()
+        conn.execute('VACUUM')
+        tracks = conn.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+        return orphans, untitled, tracks
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    # python -m utils.search compact [database path]
+    if sys.argv[1:2] == ["compact"]:
+        from config import DATABASE_PATH
+        orphans, untitled, tracks = compact(sys.argv[2] if len(sys.argv) > 2 else DATABASE_PATH)
+        print(f"Removed {orphans} orphaned queries and {untitled} untitled tracks; {tracks} tracks left")
+    else:
+        print("usage: python -m utils.search compact [database path]")
@@ -30,6 +30,21 @@ def format_time(seconds):
         return f"{minutes}m {seconds}s"
     return f"{seconds}s"
 
+def parse_shard_ids(spec):
+    """Parse "0-3,8,10-11" into [0, 1, 2, 3, 8, 10, 11]; None or "" means all shards, bad input raises ValueError"""
+    if not spec:
+        return None
+    shard_ids = set()
+    for part in spec.split(","):
+        start, dash, end = part.strip().partition("-")
+        if not start.isdigit() or (dash and not end.isdigit()):
+            raise ValueError(f"SHARD_IDS part {part.strip()!r} is not a shard id or a range like 0-3")
+        start, end = int(start), int(end) if dash else int(start)
+        if start > end:
+            raise ValueError(f"SHARD_IDS range {part.strip()!r} runs backwards")
+        shard_ids.update(range(start, end + 1))
+    return sorted(shard_ids)
+
 def can_execute_action(ctx, target):
     if target == ctx.author:
         return False, "You cannot perform this action on yourself."